@@ -1,59 +1,48 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
 import pandas as pd
 import anthropic
-import base64
 import json
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+# Claude calls share proto_chronicle's rate limiting scheduler
+import proto  # noqa: F401
+from utils.responses import TOOL_NAME, request_fields
+from utils.scheduler import INTERACTIVE
+
+from images import image_blocks, sample_bucket_images
+from store import BucketStore, EnrichmentStore
+
 app = Flask(__name__)
 CORS(app)  # Allow frontend to call API
 
 # Configuration
 IMAGE_FOLDER = "./nigerian_news_dataset/all_topics"
 DATA_FILE = "./nigerian_news_dataset/_bucketed.csv"
+RESULTS_FILE = "./nigerian_news_dataset/_enrichments.jsonl"
+SEED_FILES = ["./nigerian_news_dataset/_enriched.csv", "./ui/chronicle_data.json"]
+ENRICH_WORKERS = 4  # buckets enriched concurrently per request; the scheduler still enforces rate limits
 
-def encode_image(image_path):
-    """Convert image to base64"""
-    with open(image_path, "rb") as f:
-        return base64.b64encode(f.read()).decode('utf-8')
-
-def get_media_type(filename):
-    """Determine media type from extension"""
-    ext = filename.lower().split('.')[-1]
-    if ext in ['jpg', 'jpeg']:
-        return 'image/jpeg'
-    elif ext == 'png':
-        return 'image/png'
-    else:
-        return 'image/jpeg'
+# answer fields, requested through tool use (see proto_chronicle/utils/responses.py)
+DESCRIPTION_FIELDS = {
+    'title': "A brief title (3-5 words) that captures the key theme",
+    'summary': "A 2-sentence summary of what was happening during this period"
+}
+
+# Loaded once, reloaded whenever DATA_FILE changes on disk
+store = BucketStore(DATA_FILE)
+
+# Titles + summaries already generated, by this api or by enrich_buckets.py / dump_json.py
+results = EnrichmentStore(RESULTS_FILE, SEED_FILES)
 
 def generate_bucket_description(bucket_df, image_folder):
     """Use Claude to generate title + summary for a bucket"""
     client = anthropic.Anthropic()
     
-    sample_images = bucket_df.sort_values('date_parsed')
+    sample_images = sample_bucket_images(bucket_df)
     
-    image_content = []
-    for _, row in sample_images.iterrows():
-        image_path = Path(image_folder) / row['filename']
-        
-        if not image_path.exists():
-            print(f"  ⚠️  Image not found: {image_path}")
-            continue
-            
-        image_data = encode_image(image_path)
-        media_type = get_media_type(row['filename'])
-        
-        image_content.append({
-            "type": "image",
-            "source": {
-                "type": "base64",
-                "media_type": media_type,
-                "data": image_data,
-            }
-        })
+    image_content = image_blocks([Path(image_folder) / filename for filename in sample_images])
     
     if not image_content:
         return None, None
@@ -70,15 +59,17 @@ Generate:
 1. A brief title (3-5 words) that captures the key theme
 2. A 2-sentence summary of what was happening during this period
 
-Return ONLY valid JSON with no additional text:
-{{
-    "title": "...",
-    "summary": "..."
-}}"""
+Record the title and summary with the {TOOL_NAME} tool."""
     })
     
-    # Call Claude
-    message = client.messages.create(
+    # Call Claude; the answer is streamed, so a cut off response keeps its complete fields
+    # and only the missing one is asked for again
+    result = request_fields(
+        client,
+        DESCRIPTION_FIELDS,
+        priority=INTERACTIVE,
+        kind="bucket_description",
+        stream=True,
         model="claude-sonnet-4-20250514",
         max_tokens=1024,
         messages=[{
@@ -86,12 +77,6 @@ Return ONLY valid JSON with no additional text:
             "content": image_content
         }]
     )
-    
-    # Parse response
-    response_text = message.content[0].text.strip()
-    response_text = response_text.replace('```json', '').replace('```', '').strip()
-    
-    result = json.loads(response_text)
     return result['title'], result['summary']
 
 @app.route('/api/search', methods=['GET'])
@@ -99,21 +84,17 @@ def search():
     """Step 1: Search archives (returns metadata)"""
     query = request.args.get('query')
     
-    # Load data
-    df = pd.read_csv(DATA_FILE)
-    df['date_parsed'] = pd.to_datetime(df['date_parsed'])
-    
-    query_df = df[df['query'] == query]
+    index = store.get(query)
     
-    if len(query_df) == 0:
+    if index is None:
         return jsonify({'error': 'Query not found'}), 404
     
     return jsonify({
         'query': query,
-        'documentCount': len(query_df),
+        'documentCount': index.document_count,
         'dateRange': {
-            'min': query_df['date'].min(),
-            'max': query_df['date'].max()
+            'min': index.date_min,
+            'max': index.date_max
         }
     })
 
@@ -124,7 +105,8 @@ def home():
         'endpoints': [
             '/api/search?query=Fuel%20Subsidy',
             '/api/organize',
-            '/api/enrich'
+            '/api/enrich',
+            '/api/enrich/stream'
         ]
 })
 
@@ -134,22 +116,10 @@ def organize():
     data = request.get_json()
     query = data['query']
     
-    # Load data
-    df = pd.read_csv(DATA_FILE)
-    df['date_parsed'] = pd.to_datetime(df['date_parsed'])
-    
-    query_df = df[df['query'] == query]
+    index = store.get(query)
     
     # Get unique buckets
-    buckets = []
-    for bucket_id in sorted(query_df['bucket_id'].unique()):
-        bucket_df = query_df[query_df['bucket_id'] == bucket_id]
-        
-        buckets.append({
-            'bucket_id': int(bucket_id),
-            'bucket_label': bucket_df['bucket_label'].iloc[0],
-            'article_count': len(bucket_df)
-        })
+    buckets = index.bucket_summaries() if index is not None else []
     
     return jsonify({
         'query': query,
@@ -157,24 +127,14 @@ def organize():
         'buckets': buckets
     })
 
-@app.route('/api/enrich', methods=['POST'])
-def enrich():
-    """Step 3: Generate summaries (THIS IS WHERE CLAUDE API COSTS HAPPEN!)"""
-    data = request.get_json()
-    query = data['query']
-    
-    # Load data
-    df = pd.read_csv(DATA_FILE)
-    df['date_parsed'] = pd.to_datetime(df['date_parsed'])
-    
-    query_df = df[df['query'] == query]
-    
-    # Enrich each bucket
-    enriched_buckets = []
+def enrich_bucket(bucket_id, bucket_df):
+    """Title, summary and articles of one bucket, as returned by /api/enrich"""
+    query = bucket_df['query'].iloc[0]
+    stored = results.get(query, bucket_id, bucket_df['filename'])
     
-    for bucket_id in sorted(query_df['bucket_id'].unique()):
-        bucket_df = query_df[query_df['bucket_id'] == bucket_id]
-        
+    if stored is not None:
+        title, summary = stored
+    else:
         print(f"Enriching {bucket_df['bucket_label'].iloc[0]}...")
         
         # THIS IS THE REAL-TIME CLAUDE API CALL!
@@ -182,34 +142,86 @@ def enrich():
             title, summary = generate_bucket_description(bucket_df, IMAGE_FOLDER)
         except Exception as e:
             print(f"Error: {e}")
+            title, summary = None, None
+        
+        if title and summary:
+            results.put(query, bucket_id, bucket_df['filename'], title, summary)
+        else:
             title = f"{bucket_df['bucket_label'].iloc[0]} Coverage"
             summary = f"Articles from {bucket_df['bucket_label'].iloc[0]}"
-        
-        # Build articles list
-        articles = []
-        for _, row in bucket_df.iterrows():
-            articles.append({
-                'date': row['date'],
-                'headline': row['headline'],
-                'source': row['source'],
-                'filename': row['filename']
-            })
-        
-        enriched_buckets.append({
-            'bucket_id': int(bucket_id),
-            'bucket_label': bucket_df['bucket_label'].iloc[0],
-            'bucket_title': title,
-            'bucket_summary': summary,
-            'article_count': len(bucket_df),
-            'articles': articles
+    
+    # Build articles list
+    articles = []
+    for _, row in bucket_df.iterrows():
+        articles.append({
+            'date': row['date'],
+            'headline': row['headline'],
+            'source': row['source'],
+            'filename': row['filename']
         })
-        
-        time.sleep(0.5)  # Small delay between calls
+    
+    return {
+        'bucket_id': int(bucket_id),
+        'bucket_label': bucket_df['bucket_label'].iloc[0],
+        'bucket_title': title,
+        'bucket_summary': summary,
+        'article_count': len(bucket_df),
+        'articles': articles
+    }
+
+@app.route('/api/enrich', methods=['POST'])
+def enrich():
+    """Step 3: Generate summaries (THIS IS WHERE CLAUDE API COSTS HAPPEN!)"""
+    data = request.get_json()
+    query = data['query']
+    
+    index = store.get(query)
+    bucket_items = list(index.buckets.items()) if index is not None else []
+    
+    # Enrich buckets concurrently, keeping them in timeline order
+    with ThreadPoolExecutor(max_workers=ENRICH_WORKERS) as pool:
+        enriched_buckets = list(pool.map(lambda item: enrich_bucket(*item), bucket_items))
     
     return jsonify({
         'query': query,
         'buckets': enriched_buckets
     })
 
+@app.route('/api/enrich/stream', methods=['POST'])
+def enrich_stream():
+    """
+    Step 3, streamed: one event per bucket as soon as its summary is ready, in completion order.
+    Events are NDJSON lines, or Server-Sent Events if the client accepts text/event-stream.
+    """
+    data = request.get_json()
+    query = data['query']
+    sse = 'text/event-stream' in request.headers.get('Accept', '')
+    
+    index = store.get(query)
+    bucket_items = list(index.buckets.items()) if index is not None else []
+    
+    def event(kind, payload):
+        payload = json.dumps({'type': kind, **payload})
+        return f"event: {kind}\ndata: {payload}\n\n" if sse else payload + '\n'
+    
+    def events():
+        yield event('start', {'query': query, 'bucketCount': len(bucket_items)})
+        pool = ThreadPoolExecutor(max_workers=ENRICH_WORKERS)
+        try:
+            futures = [pool.submit(enrich_bucket, bucket_id, bucket_df) for bucket_id, bucket_df in bucket_items]
+            for future in as_completed(futures):
+                yield event('bucket', {'bucket': future.result()})
+        finally:
+            # the client may disconnect early: drop the buckets nobody will read
+            pool.shutdown(wait=False, cancel_futures=True)
+        yield event('done', {'query': query})
+    
+    return Response(
+        events(),
+        mimetype='text/event-stream' if sse else 'application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 if __name__ == '__main__':
+    store.queries()  # load the dataset before serving
     app.run(debug=True, port=5000)
\ No newline at end of file
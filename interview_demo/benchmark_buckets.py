@@ -0,0 +1,75 @@
+# benchmark_buckets.py
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from create_buckets import assign_bucket, calculate_bucket_size, create_buckets, parse_date
+
+# (query, first year, last year) - one span per bucket size
+QUERIES = [
+    ("Oil Boom", 1960, 2024),
+    ("Fuel Subsidy", 1985, 2024),
+    ("Elections", 2009, 2024),
+    ("Naira Redesign", 2019, 2024),
+]
+
+def create_buckets_rowwise(df):
+    """The original per-row implementation, kept as the reference output"""
+    df['date_parsed'] = df['date'].apply(parse_date)
+
+    results = []
+    for query in df['query'].unique():
+        query_df = df[df['query'] == query].copy()
+
+        bucket_size = calculate_bucket_size(query_df['date_parsed'].min(), query_df['date_parsed'].max())
+        query_df[['bucket_id', 'bucket_label']] = query_df['date_parsed'].apply(
+            lambda d: pd.Series(assign_bucket(d, bucket_size))
+        )
+        results.append(query_df)
+
+    return pd.concat(results, ignore_index=True)
+
+def synthetic_dataset(nb_rows, seed=0):
+    """nb_rows articles spread over QUERIES, in random order, with DD/MM/YYYY dates"""
+    rng = np.random.default_rng(seed)
+    query_idx = rng.integers(0, len(QUERIES), nb_rows)
+
+    first = np.array([np.datetime64(f"{start}-01-01") for _, start, _ in QUERIES])
+    last  = np.array([np.datetime64(f"{end}-12-31") for _, _, end in QUERIES])
+    span  = (last - first).astype(np.int64)
+    dates = first[query_idx] + (rng.random(nb_rows) * span[query_idx]).astype(np.int64).astype('timedelta64[D]')
+
+    return pd.DataFrame({
+        'query': np.array([query for query, _, _ in QUERIES], dtype=object)[query_idx],
+        'date': pd.Series(dates).dt.strftime('%d/%m/%Y'),
+        'headline': 'headline',
+    })
+
+def timed(fn, df):
+    start = time.perf_counter()
+    result = fn(df.copy())
+    return result, time.perf_counter() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare vectorized and row-wise bucketing")
+    parser.add_argument('--rows', type=int, default=2_000_000, help="rows for the vectorized run")
+    parser.add_argument('--reference-rows', type=int, default=50_000,
+                        help="rows for the (slow) row-wise run, also used to check outputs match")
+    args = parser.parse_args()
+
+    sample = synthetic_dataset(args.reference_rows)
+    expected, rowwise_time = timed(create_buckets_rowwise, sample)
+    actual, vector_time = timed(create_buckets, sample)
+
+    columns = ['query', 'date', 'bucket_id', 'bucket_label']
+    assert expected[columns].astype(str).equals(actual[columns].astype(str)), "bucket assignments differ"
+    print(f"\n{args.reference_rows:,} rows: row-wise {rowwise_time:.2f}s, vectorized {vector_time:.3f}s "
+          f"({rowwise_time / vector_time:.0f}x), outputs identical")
+
+    full = synthetic_dataset(args.rows)
+    _, full_time = timed(create_buckets, full)
+    estimated = rowwise_time * args.rows / args.reference_rows
+    print(f"{args.rows:,} rows: vectorized {full_time:.2f}s, row-wise ~{estimated:.0f}s (extrapolated)")
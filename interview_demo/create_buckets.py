@@ -1,5 +1,8 @@
 # create_buckets.py
 
+import calendar
+
+import numpy as np
 import pandas as pd
 from datetime import datetime
 
@@ -36,41 +39,85 @@ def assign_bucket(date, bucket_size):
     elif bucket_size == 'month':
         return (date.strftime('%Y-%m'), date.strftime('%B %Y'))
 
+def bucket_keys(dates, bucket_size):
+    """
+    Vectorized assign_bucket: integer bucket key for each datetime64 value.
+    Year based sizes key on the bucket's start year, 'month' keys on months since 1970-01.
+    """
+    if bucket_size == 'month':
+        return dates.astype('datetime64[M]').astype(np.int64)
+
+    years = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+    if bucket_size == 'decade':
+        return (years // 10) * 10
+    elif bucket_size == '5year':
+        return (years // 5) * 5
+    return years
+
+def bucket_from_key(key, bucket_size):
+    """(bucket_id, bucket_label) for one key from bucket_keys, matching assign_bucket"""
+    if bucket_size == 'month':
+        year, month = 1970 + key // 12, key % 12 + 1
+        return (f"{year:04d}-{month:02d}", f"{calendar.month_name[month]} {year}")
+    return assign_bucket(datetime(int(key), 1, 1), bucket_size)
+
+def assign_buckets(dates, bucket_size):
+    """
+    Assign every date in a datetime64 array to its bucket.
+    Labels are only formatted once per distinct bucket, then broadcast back to the rows.
+    """
+    codes, keys = pd.factorize(bucket_keys(dates, bucket_size))
+    buckets = [bucket_from_key(int(key), bucket_size) for key in keys]
+
+    ids    = pd.Series([bucket_id for bucket_id, _ in buckets]).to_numpy()
+    labels = np.array([label for _, label in buckets], dtype=object)
+    return ids[codes], labels[codes]
+
 def create_buckets(df):
     """Main function: add bucket columns to dataframe"""
-    # Parse dates
-    df['date_parsed'] = df['date'].apply(parse_date)
-    
-    # Process each query separately
-    results = []
-    
-    for query in df['query'].unique():
-        query_df = df[df['query'] == query].copy()
-        
-        # Calculate bucket size for this query
-        min_date = query_df['date_parsed'].min()
-        max_date = query_df['date_parsed'].max()
+    # Parse dates, once per distinct date string
+    date_codes, date_strings = pd.factorize(df['date'])
+    df['date_parsed'] = pd.to_datetime(date_strings, format='%d/%m/%Y').take(date_codes, allow_fill=True, fill_value=pd.NaT)
+
+    # Rows of each query are grouped together, queries in order of first appearance
+    query_codes, queries = pd.factorize(df['query'])
+    df = df.iloc[np.argsort(query_codes, kind='stable')].reset_index(drop=True)
+    query_codes = np.sort(query_codes, kind='stable')
+
+    # Calculate bucket size for each query
+    by_query = df.groupby('query', sort=False)['date_parsed']
+    min_dates = by_query.transform('min')
+    max_dates = by_query.transform('max')
+
+    dates = df['date_parsed'].to_numpy(dtype='datetime64[ns]')
+    bucket_ids    = np.empty(len(df), dtype=object)
+    bucket_labels = np.empty(len(df), dtype=object)
+
+    starts = np.searchsorted(query_codes, np.arange(len(queries)), side='left')
+    ends   = np.searchsorted(query_codes, np.arange(len(queries)), side='right')
+
+    for query, start, end in zip(queries, starts, ends):
+        min_date = min_dates.iloc[start]
+        max_date = max_dates.iloc[start]
         bucket_size = calculate_bucket_size(min_date, max_date)
-        
+
         print(f"\n{query}:")
         print(f"  Timespan: {min_date.year} - {max_date.year}")
         print(f"  Bucket size: {bucket_size}")
-        
+
         # Assign buckets
-        query_df[['bucket_id', 'bucket_label']] = query_df['date_parsed'].apply(
-            lambda d: pd.Series(assign_bucket(d, bucket_size))
-        )
-        
-        results.append(query_df)
-    
-    # Combine back together
-    return pd.concat(results, ignore_index=True)
+        bucket_ids[start:end], bucket_labels[start:end] = assign_buckets(dates[start:end], bucket_size)
+
+    df['bucket_id'] = pd.Series(bucket_ids).infer_objects()
+    df['bucket_label'] = bucket_labels
+    return df
 
-# Load your CSV
-df = pd.read_csv('nigerian_news_dataset/_dataset.csv')
+if __name__ == "__main__":
+    # Load your CSV
+    df = pd.read_csv('nigerian_news_dataset/_dataset.csv')
 
-# Create buckets
-df_bucketed = create_buckets(df)
+    # Create buckets
+    df_bucketed = create_buckets(df)
 
-# Save
-df_bucketed.to_csv('nigerian_news_dataset/_bucketed.csv', index=False)
\ No newline at end of file
+    # Save
+    df_bucketed.to_csv('nigerian_news_dataset/_bucketed.csv', index=False)
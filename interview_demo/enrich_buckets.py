@@ -1,56 +1,39 @@
 # encrich_buckets.py
 
 import anthropic
-import base64
+import argparse
+import hashlib
 import json
+import os
 import pandas as pd
 import time
 
 from pathlib import Path
 
-def encode_image(image_path):
-    """Convert image to base64"""
-    with open(image_path, "rb") as f:
-        return base64.b64encode(f.read()).decode('utf-8')
-
-def get_media_type(filename):
-    """Determine media type from extension"""
-    ext = filename.lower().split('.')[-1]
-    if ext in ['jpg', 'jpeg']:
-        return 'image/jpeg'
-    elif ext == 'png':
-        return 'image/png'
-    else:
-        return 'image/jpeg'  # default
+# Claude calls share proto_chronicle's rate limiting scheduler
+import proto  # noqa: F401
+from utils.responses import TOOL_NAME, ResponseError, message_fields, missing_fields, request_fields, tool_params
+from utils.scheduler import BATCH
 
-def generate_bucket_description(bucket_df, image_folder):
-    """Use Claude to generate title + summary for a bucket"""
-    client = anthropic.Anthropic()
-    
-    sample_images = bucket_df.sort_values('date_parsed')
+from images import image_blocks, sample_bucket_images
+from store import article_set_hash
+
+MODEL = "claude-sonnet-4-20250514"
+
+# answer fields, requested through tool use (see proto_chronicle/utils/responses.py)
+DESCRIPTION_FIELDS = {
+    'title': "A brief title (3-5 words) that captures the key theme",
+    'summary': "A 2-sentence summary of what was happening during this period"
+}
+
+def build_bucket_content(bucket_df, image_folder):
+    """Images + prompt for a bucket, or None if none of its images exist"""
+    sample_images = sample_bucket_images(bucket_df)
     
-    image_content = []
-    for _, row in sample_images.iterrows():
-        image_path = Path(image_folder) / row['filename']
-        
-        if not image_path.exists():
-            print(f"  ⚠️  Image not found: {image_path}")
-            continue
-            
-        image_data = encode_image(image_path)
-        media_type = get_media_type(row['filename'])
-        
-        image_content.append({
-            "type": "image",
-            "source": {
-                "type": "base64",
-                "media_type": media_type,
-                "data": image_data,
-            }
-        })
+    image_content = image_blocks([Path(image_folder) / filename for filename in sample_images])
     
     if not image_content:
-        return None, None
+        return None
     
     # Add text prompt
     bucket_label = bucket_df['bucket_label'].iloc[0]
@@ -64,29 +47,39 @@ Generate:
 1. A brief title (3-5 words) that captures the key theme
 2. A 2-sentence summary of what was happening during this period
 
-Return ONLY valid JSON with no additional text:
-{{
-    "title": "...",
-    "summary": "..."
-}}"""
+Record the title and summary with the {TOOL_NAME} tool."""
     })
+    return image_content
+
+def parse_description(message):
+    """(title, summary) from the model's tool use or JSON answer, repaired locally if needed"""
+    result = message_fields(message)
+    missing = missing_fields(result, DESCRIPTION_FIELDS)
+    if missing:
+        raise ResponseError(f"Missing required fields in response: {', '.join(missing)}")
+    return result['title'], result['summary']
+
+def generate_bucket_description(bucket_df, image_folder):
+    """Use Claude to generate title + summary for a bucket"""
+    client = anthropic.Anthropic()
+    
+    image_content = build_bucket_content(bucket_df, image_folder)
+    if image_content is None:
+        return None, None
     
-    # Call Claude
-    message = client.messages.create(
-        model="claude-sonnet-4-20250514",
+    # Call Claude; a missing field is asked for again on its own
+    result = request_fields(
+        client,
+        DESCRIPTION_FIELDS,
+        priority=BATCH,
+        kind="bucket_description",
+        model=MODEL,
         max_tokens=1024,
         messages=[{
             "role": "user",
             "content": image_content
         }]
     )
-    
-    # Parse response
-    response_text = message.content[0].text.strip()
-    # Remove markdown code blocks if present
-    response_text = response_text.replace('```json', '').replace('```', '').strip()
-    
-    result = json.loads(response_text)
     return result['title'], result['summary']
 
 def enrich_buckets(df, image_folder):
@@ -125,12 +118,162 @@ def enrich_buckets(df, image_folder):
                 bucket_df['bucket_summary'] = f"Articles from {bucket_label}"
             
             results.append(bucket_df)
-            time.sleep(1)  # Rate limiting
+    
+    return pd.concat(results, ignore_index=True)
+
+def with_description(bucket_df, title, summary):
+    """Copy of bucket_df with the bucket title + summary columns, or the fallback ones"""
+    bucket_label = bucket_df['bucket_label'].iloc[0]
+    bucket_df = bucket_df.copy()
+    bucket_df['bucket_title'] = title if title else f"{bucket_label} Coverage"
+    bucket_df['bucket_summary'] = summary if summary else f"Articles from {bucket_label}"
+    return bucket_df
+
+# ---------------------------------------------------------------------------
+# Batch mode: every bucket prompt is submitted through the Message Batches API,
+# which is cheaper and has no per-call idle time. Progress is kept in a manifest,
+# so an interrupted run resumes from the batches it already submitted.
+
+MANIFEST_FILE = './nigerian_news_dataset/_enrich_batch_manifest.json'
+MAX_BATCH_REQUESTS = 10000
+MAX_BATCH_BYTES = 200 * 1024 * 1024  # the API limit is 256 MB per batch
+POLL_INTERVAL = 60  # seconds
+
+def bucket_custom_id(query, bucket_id, filenames):
+    """
+    Stable id for a (query, bucket, article set), valid as a batch custom_id. A bucket whose
+    articles changed gets a new id, so its stale result is not reused and it is submitted again.
+    """
+    material = f"{query}\x1f{bucket_id}\x1f{article_set_hash(filenames)}"
+    digest = hashlib.sha1(material.encode('utf-8')).hexdigest()[:24]
+    return f"bucket-{digest}"
+
+def load_manifest(manifest_path):
+    if Path(manifest_path).exists():
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {'batches': [], 'results': {}}
+
+def save_manifest(manifest, manifest_path):
+    """Write the manifest atomically, so a crash never leaves it half written"""
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+def submit_batch(client, requests, manifest, manifest_path):
+    """Create one batch and record it in the manifest before doing anything else"""
+    batch = client.messages.batches.create(requests=requests)
+    manifest['batches'].append({
+        'id': batch.id,
+        'custom_ids': [request['custom_id'] for request in requests],
+        'done': False
+    })
+    save_manifest(manifest, manifest_path)
+    print(f"  → Submitted batch {batch.id} ({len(requests)} buckets)")
+
+def submit_batches(client, requests, manifest, manifest_path):
+    """Submit requests (any iterable) in batches under the API's count and size limits"""
+    chunk, chunk_bytes = [], 0
+    for request in requests:
+        request_bytes = len(json.dumps(request))
+        if chunk and (len(chunk) >= MAX_BATCH_REQUESTS or chunk_bytes + request_bytes > MAX_BATCH_BYTES):
+            submit_batch(client, chunk, manifest, manifest_path)
+            chunk, chunk_bytes = [], 0
+        chunk.append(request)
+        chunk_bytes += request_bytes
+    if chunk:
+        submit_batch(client, chunk, manifest, manifest_path)
+
+def collect_batch(client, batch_entry, manifest, manifest_path, poll_interval):
+    """Wait for a batch to end and record its successful results in the manifest"""
+    while True:
+        batch = client.messages.batches.retrieve(batch_entry['id'])
+        if batch.processing_status == 'ended':
+            break
+        print(f"  … batch {batch_entry['id']} is {batch.processing_status}, checking again in {poll_interval}s")
+        time.sleep(poll_interval)
+    
+    for result in client.messages.batches.results(batch_entry['id']):
+        if result.result.type != 'succeeded':
+            print(f"  ✗ {result.custom_id}: {result.result.type}")
+            continue
+        try:
+            title, summary = parse_description(result.result.message)
+            manifest['results'][result.custom_id] = {'title': title, 'summary': summary}
+        except Exception as e:
+            print(f"  ✗ {result.custom_id}: {e}")
+    
+    batch_entry['done'] = True
+    save_manifest(manifest, manifest_path)
+
+def enrich_buckets_batch(df, image_folder, manifest_path=MANIFEST_FILE, client=None, poll_interval=POLL_INTERVAL):
+    """
+    Same output as enrich_buckets, with every bucket enriched through one or more
+    message batches instead of one synchronous call per bucket.
+    Buckets whose requests failed are resubmitted on the next run.
+    """
+    client = client or anthropic.Anthropic()
+    manifest = load_manifest(manifest_path)
+    
+    buckets = []
+    for query in df['query'].unique():
+        query_df = df[df['query'] == query]
+        for bucket_id in sorted(query_df['bucket_id'].unique()):
+            bucket_df = query_df[query_df['bucket_id'] == bucket_id]
+            buckets.append((bucket_custom_id(query, bucket_id, bucket_df['filename']), bucket_df))
+    
+    # Buckets submitted in a batch that has not been collected yet
+    in_flight = {
+        custom_id
+        for batch_entry in manifest['batches'] if not batch_entry['done']
+        for custom_id in batch_entry['custom_ids']
+    }
+    
+    # Buckets that neither have a result nor are part of a batch still running
+    pending = [
+        (custom_id, bucket_df) for custom_id, bucket_df in buckets
+        if custom_id not in manifest['results'] and custom_id not in in_flight
+    ]
+    print(f"\n📦 {len(manifest['results'])} buckets already enriched, {len(in_flight)} in flight, {len(pending)} to submit")
+    
+    # Requests are built lazily, so only one batch worth of images is held in memory
+    def requests():
+        for custom_id, bucket_df in pending:
+            image_content = build_bucket_content(bucket_df, image_folder)
+            if image_content is None:
+                continue
+            yield {
+                'custom_id': custom_id,
+                'params': {
+                    'model': MODEL,
+                    'max_tokens': 1024,
+                    'messages': [{"role": "user", "content": image_content}],
+                    **tool_params(DESCRIPTION_FIELDS)
+                }
+            }
+    
+    submit_batches(client, requests(), manifest, manifest_path)
+    
+    for batch_entry in manifest['batches']:
+        if not batch_entry['done']:
+            collect_batch(client, batch_entry, manifest, manifest_path, poll_interval)
+    
+    # Merge back, in the same order as enrich_buckets
+    results = []
+    for custom_id, bucket_df in buckets:
+        result = manifest['results'].get(custom_id, {})
+        results.append(with_description(bucket_df, result.get('title'), result.get('summary')))
     
     return pd.concat(results, ignore_index=True)
 
 # Main execution
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate bucket titles and summaries")
+    parser.add_argument('--batch', action='store_true', help="use the Message Batches API")
+    parser.add_argument('--manifest', default=MANIFEST_FILE, help="batch job manifest, for resuming")
+    args = parser.parse_args()
+    
     # Load bucketed data
     df = pd.read_csv('./nigerian_news_dataset/_bucketed.csv')
     df['date_parsed'] = pd.to_datetime(df['date_parsed'])
@@ -138,7 +281,10 @@ if __name__ == "__main__":
     # Enrich buckets with titles and summaries
     IMAGE_FOLDER = "./nigerian_news_dataset/all_topics"
     print("🤖 Generating bucket descriptions with Claude...")
-    df_enriched = enrich_buckets(df, IMAGE_FOLDER)
+    if args.batch:
+        df_enriched = enrich_buckets_batch(df, IMAGE_FOLDER, manifest_path=args.manifest)
+    else:
+        df_enriched = enrich_buckets(df, IMAGE_FOLDER)
     
     # Save and print results
     df_enriched.to_csv('./nigerian_news_dataset/_enriched.csv', index=False)
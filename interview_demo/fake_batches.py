@@ -0,0 +1,59 @@
+# fake_batches.py
+
+import itertools
+import json
+
+# Local stand-in for the Message Batches endpoint, to test enrich_buckets_batch offline:
+#
+#   from fake_batches import FakeBatchClient
+#   enrich_buckets_batch(df, IMAGE_FOLDER, client=FakeBatchClient(), poll_interval=0)
+
+class FakeObject:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+class FakeBatches:
+    def __init__(self, polls_until_done, fail_custom_ids):
+        self.polls_until_done = polls_until_done
+        self.fail_custom_ids = set(fail_custom_ids)
+        self.jobs = {}
+        self.ids = itertools.count(1)
+
+    def create(self, requests):
+        batch_id = f"msgbatch_fake_{next(self.ids)}"
+        self.jobs[batch_id] = {'requests': list(requests), 'polls': 0}
+        return FakeObject(id=batch_id, processing_status='in_progress')
+
+    def retrieve(self, batch_id):
+        job = self.jobs[batch_id]
+        job['polls'] += 1
+        status = 'ended' if job['polls'] > self.polls_until_done else 'in_progress'
+        return FakeObject(id=batch_id, processing_status=status)
+
+    def results(self, batch_id):
+        for request in self.jobs[batch_id]['requests']:
+            custom_id = request['custom_id']
+            if custom_id in self.fail_custom_ids:
+                yield FakeObject(custom_id=custom_id, result=FakeObject(type='errored'))
+                continue
+
+            prompt = request['params']['messages'][-1]['content'][-1]['text']
+            nb_images = len(request['params']['messages'][-1]['content']) - 1
+            answer = {
+                'title': f"Fake title for {custom_id}",
+                'summary': f"{nb_images} pages. {prompt.splitlines()[0]}"
+            }
+            if request['params'].get('tools'):
+                content = FakeObject(type='tool_use', name=request['params']['tools'][0]['name'], input=answer)
+            else:
+                content = FakeObject(type='text', text=json.dumps(answer))
+            message = FakeObject(content=[content])
+            yield FakeObject(custom_id=custom_id, result=FakeObject(type='succeeded', message=message))
+
+class FakeBatchClient:
+    """
+    Batches end after {polls_until_done} status checks; requests whose custom_id is in
+    {fail_custom_ids} come back errored.
+    """
+    def __init__(self, polls_until_done=1, fail_custom_ids=()):
+        self.messages = FakeObject(batches=FakeBatches(polls_until_done, fail_custom_ids))
@@ -0,0 +1,217 @@
+# images.py
+
+import base64
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import CancelledError, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from PIL import Image
+
+# Samplers are shared with proto_chronicle
+import proto  # noqa: F401
+from sample import make_sampler, text_terms
+
+# Newspaper scans are downsized and recompressed once, and the ready-to-send base64
+# payloads are cached on disk under a hash of the original file's content. A small .ref file,
+# keyed on the file's path, size and modification time, points to that payload, so a warm
+# cache is read without opening the scans; they are only read and hashed on a miss.
+
+CACHE_DIR = "./nigerian_news_dataset/_image_cache"
+MAX_EDGE = 1568  # longest edge, in pixels; larger images are downscaled by the API anyway
+MAX_BYTES = 1024 * 1024  # encoded size budget per image, before base64
+MIN_QUALITY = 40
+PREPARE_VERSION = 1  # bump when the preparation below changes, to invalidate the cache
+
+# Large buckets only send a representative sample of their images (see proto_chronicle/sample.py)
+IMAGE_SAMPLER = "spread"  # "spread", "top", "mmr", or None to send every image
+MAX_IMAGES = 20
+
+# The pool is created lazily from the api's worker threads; forking a multithreaded process can
+# deadlock the child, so workers are spawned fresh instead
+POOL_CONTEXT = "spawn"
+PREPARE_TIMEOUT = 60  # seconds to wait for one image from the pool
+
+# An unreadable or corrupt image is skipped rather than failing its whole bucket
+IMAGE_ERRORS = (OSError, ValueError, SyntaxError, Image.DecompressionBombError)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def cache_key(data, max_edge, max_bytes):
+    digest = hashlib.sha256(data)
+    digest.update(f"|{max_edge}|{max_bytes}|{PREPARE_VERSION}".encode('utf-8'))
+    return digest.hexdigest()
+
+def stat_key(image_path, max_edge, max_bytes):
+    """Key of an image file as it is on disk now, without reading it"""
+    stat = os.stat(image_path)
+    material = f"{os.path.abspath(image_path)}|{stat.st_size}|{stat.st_mtime_ns}|{max_edge}|{max_bytes}|{PREPARE_VERSION}"
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+def _write_atomic(path, text):
+    tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def _get_pool(max_workers):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(POOL_CONTEXT))
+        return _pool
+
+def _reset_pool(pool):
+    """Drop a broken or stuck pool, so the next call starts a new one"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def shrink(data, max_edge=MAX_EDGE, max_bytes=MAX_BYTES):
+    """
+    (media_type, bytes) of an image fitting max_edge and max_bytes.
+    Images already within both limits are sent as they are.
+    """
+    image = Image.open(io.BytesIO(data))
+    if max(image.size) <= max_edge and len(data) <= max_bytes and image.format in ('JPEG', 'PNG'):
+        return f"image/{image.format.lower()}", data
+
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    # Lower the quality first, then the resolution, until the budget is met
+    quality = 85
+    while True:
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=quality, optimize=True)
+        if buffer.tell() <= max_bytes or max(image.size) <= 256:
+            return 'image/jpeg', buffer.getvalue()
+        if quality > MIN_QUALITY:
+            quality -= 15
+        else:
+            image = image.resize((int(image.width * 0.75), int(image.height * 0.75)), Image.LANCZOS)
+
+def _prepare(image_path, key, max_edge, max_bytes, cache_dir):
+    """Shrink one image and write its payload to the cache. Runs in a worker process."""
+    with open(image_path, 'rb') as f:
+        data = f.read()
+    media_type, encoded = shrink(data, max_edge, max_bytes)
+    payload = base64.b64encode(encoded).decode('utf-8')
+
+    _write_atomic(Path(cache_dir) / f"{key}.b64", f"{media_type}\n{payload}")
+    return media_type, payload
+
+def _read_cached(cache_path):
+    with open(cache_path, 'r', encoding='utf-8') as f:
+        media_type, payload = f.read().split('\n', 1)
+    return media_type, payload
+
+def prepare_images(image_paths, max_edge=MAX_EDGE, max_bytes=MAX_BYTES, cache_dir=CACHE_DIR, max_workers=None):
+    """
+    (media_type, base64 data) for each image path, in order, or None where the file is missing
+    or could not be prepared. Cached payloads are read from disk; the rest are prepared in
+    parallel on a process pool.
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    prepared = [None] * len(image_paths)
+    misses = []
+    for i, image_path in enumerate(image_paths):
+        try:
+            ref_path = cache_dir / f"{stat_key(image_path, max_edge, max_bytes)}.ref"
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            print(f"  ⚠️  Could not read image {image_path}: {e}")
+            continue
+
+        # warm: the file is unchanged since its payload was cached
+        if ref_path.exists():
+            cache_path = cache_dir / f"{ref_path.read_text(encoding='utf-8')}.b64"
+            if cache_path.exists():
+                prepared[i] = _read_cached(cache_path)
+                continue
+
+        try:
+            with open(image_path, 'rb') as f:
+                key = cache_key(f.read(), max_edge, max_bytes)
+        except OSError as e:
+            print(f"  ⚠️  Could not read image {image_path}: {e}")
+            continue
+        cache_path = cache_dir / f"{key}.b64"
+        if cache_path.exists():
+            prepared[i] = _read_cached(cache_path)
+            _write_atomic(ref_path, key)
+        else:
+            misses.append((i, image_path, key, ref_path))
+
+    if len(misses) == 1:
+        i, image_path, key, ref_path = misses[0]
+        try:
+            prepared[i] = _prepare(str(image_path), key, max_edge, max_bytes, str(cache_dir))
+            _write_atomic(ref_path, key)
+        except IMAGE_ERRORS as e:
+            print(f"  ⚠️  Could not prepare image {image_path}: {e}")
+    elif misses:
+        pool = _get_pool(max_workers)
+        futures = [
+            (i, image_path, key, ref_path, pool.submit(_prepare, str(image_path), key, max_edge, max_bytes, str(cache_dir)))
+            for i, image_path, key, ref_path in misses
+        ]
+        stuck = False
+        for i, image_path, key, ref_path, future in futures:
+            try:
+                # once the pool is dropped, only collect what it already finished
+                prepared[i] = future.result(timeout=0 if stuck else PREPARE_TIMEOUT)
+                _write_atomic(ref_path, key)
+            except (FutureTimeoutError, BrokenProcessPool, CancelledError) as e:
+                print(f"  ⚠️  Could not prepare image {image_path}: {e or type(e).__name__}")
+                if not stuck:
+                    stuck = True
+                    _reset_pool(pool)
+            except IMAGE_ERRORS as e:
+                print(f"  ⚠️  Could not prepare image {image_path}: {e}")
+
+    return prepared
+
+def sample_bucket_images(bucket_df, strategy=IMAGE_SAMPLER, max_images=MAX_IMAGES):
+    """Filenames of the images to send for a bucket, in date order"""
+    rows = bucket_df.sort_values('date_parsed').to_dict('records')
+    if strategy is not None:
+        query_terms = set(str(bucket_df['query'].iloc[0]).lower().split())
+        sampler = make_sampler(
+            strategy,
+            date=lambda row: row['date_parsed'],
+            score=lambda row: len(query_terms & set(str(row.get('headline', '')).lower().split())),
+            terms=lambda row: text_terms(str(row.get('headline', '')).split(), [str(row.get('source', ''))]),
+        )
+        rows = sampler.select(rows, max_items=max_images)
+    return [row['filename'] for row in rows]
+
+def image_blocks(image_paths, **kwargs):
+    """Message content blocks for the images that exist, warning about missing ones"""
+    blocks = []
+    for image_path, image in zip(image_paths, prepare_images(image_paths, **kwargs)):
+        if image is None:
+            if not Path(image_path).exists():
+                print(f"  ⚠️  Image not found: {image_path}")
+            continue
+        media_type, data = image
+        blocks.append({
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": media_type,
+                "data": data,
+            }
+        })
+    return blocks
@@ -0,0 +1,17 @@
+# proto.py
+
+import sys
+from pathlib import Path
+
+# The one place that makes proto_chronicle's modules (the shared Claude scheduler, response
+# parsing, samplers) importable from interview_demo. proto_chronicle is a flat-module project
+# whose modules import each other by top-level name (utils.*, data.*, sample), so they are
+# imported the same way here, once this module has been imported:
+#
+#   import proto  # noqa: F401
+#   from utils.scheduler import scheduler
+
+PROTO_CHRONICLE_DIR = str(Path(__file__).resolve().parent.parent / "proto_chronicle")
+
+if PROTO_CHRONICLE_DIR not in sys.path:
+    sys.path.append(PROTO_CHRONICLE_DIR)
@@ -0,0 +1,195 @@
+# store.py
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+class QueryIndex:
+    """Rows for one query, pre-grouped by bucket"""
+    def __init__(self, query, query_df):
+        self.query          = query
+        self.df             = query_df
+        self.document_count = len(query_df)
+        self.date_min       = query_df['date'].min()
+        self.date_max       = query_df['date'].max()
+
+        # bucket_id -> rows of that bucket, in ascending bucket order
+        self.buckets = {
+            bucket_id: bucket_df
+            for bucket_id, bucket_df in query_df.groupby('bucket_id', sort=True)
+        }
+
+    def bucket_summaries(self):
+        """bucket_id, bucket_label and article_count for each bucket"""
+        return [
+            {
+                'bucket_id': int(bucket_id),
+                'bucket_label': bucket_df['bucket_label'].iloc[0],
+                'article_count': len(bucket_df)
+            }
+            for bucket_id, bucket_df in self.buckets.items()
+        ]
+
+class BucketStore:
+    """
+    Loads the bucketed CSV once and serves per-query indexes from memory.
+    The file is reloaded automatically when its modification time changes.
+    """
+    def __init__(self, data_file):
+        self.data_file = data_file
+        self._lock     = threading.Lock()
+        self._mtime    = None
+        self._queries  = {}
+
+    def _load(self, mtime):
+        df = pd.read_csv(self.data_file)
+        df['date_parsed'] = pd.to_datetime(df['date_parsed'])
+
+        self._queries = {
+            query: QueryIndex(query, query_df)
+            for query, query_df in df.groupby('query', sort=False)
+        }
+        self._mtime = mtime
+
+    def _refresh(self):
+        mtime = os.stat(self.data_file).st_mtime_ns
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime != self._mtime:
+                print(f"Loading {self.data_file}...")
+                self._load(mtime)
+
+    def get(self, query):
+        """Returns the QueryIndex for query, or None if the query has no rows"""
+        self._refresh()
+        return self._queries.get(query)
+
+    def queries(self):
+        self._refresh()
+        return list(self._queries.keys())
+
+def article_set_hash(filenames):
+    """Order independent hash of a bucket's article filenames"""
+    digest = hashlib.sha256()
+    for filename in sorted(str(filename) for filename in filenames):
+        digest.update(filename.encode('utf-8') + b'\x1f')
+    return digest.hexdigest()[:16]
+
+def is_fallback(bucket_label, title, summary):
+    """Whether a title + summary are the placeholders written when enrichment failed"""
+    return title == f"{bucket_label} Coverage" and summary == f"Articles from {bucket_label}"
+
+class EnrichmentStore:
+    """
+    Read-through store of bucket titles and summaries, keyed by (query, bucket_id, article set hash),
+    so that a bucket whose articles changed is enriched again.
+    New results are appended to results_file, a JSONL log in which the last record of a bucket
+    wins; the log is compacted when it is loaded. On first use the store is also seeded from
+    enrich_buckets.py's CSV output and dump_json.py's JSON output, if they exist.
+    """
+    def __init__(self, results_file, seed_files=()):
+        self.results_file = results_file
+        self.seed_files   = list(seed_files)
+        self._lock        = threading.Lock()
+        self._results     = None  # (query, bucket_id, article set hash) -> (title, summary)
+        self._log         = None  # results_file, open for appending
+
+    def _load(self):
+        results = {}
+        for seed_file in self.seed_files:
+            if Path(seed_file).exists():
+                for key, value in self._read_seed(seed_file):
+                    results.setdefault(key, value)
+
+        # results written by the api take precedence over the seeds
+        if Path(self.results_file).exists():
+            logged = {}
+            nb_records = 0
+            with open(self.results_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    nb_records += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # a record cut off by a crash
+                    key = (record['query'], int(record['bucket_id']), record['articles_hash'])
+                    logged[key] = (record['bucket_title'], record['bucket_summary'])
+            if nb_records > len(logged):
+                self._compact(logged)
+            results.update(logged)
+
+        print(f"Loaded {len(results)} stored bucket enrichments")
+        self._results = results
+
+    def _compact(self, logged):
+        """Rewrite the results log with one record per bucket"""
+        tmp_path = f"{self.results_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for key, value in logged.items():
+                f.write(self._record_line(key, value))
+        os.replace(tmp_path, self.results_file)
+
+    @staticmethod
+    def _record_line(key, value):
+        (query, bucket_id, articles_hash), (title, summary) = key, value
+        return json.dumps({
+            'query': query,
+            'bucket_id': bucket_id,
+            'articles_hash': articles_hash,
+            'bucket_title': title,
+            'bucket_summary': summary
+        }) + "\n"
+
+    def _read_seed(self, seed_file):
+        """((query, bucket_id, article set hash), (title, summary)) of every enriched bucket in a seed file"""
+        if str(seed_file).endswith('.csv'):
+            df = pd.read_csv(seed_file)
+            buckets = (
+                (query, bucket_id, bucket_df['bucket_label'].iloc[0], bucket_df['bucket_title'].iloc[0],
+                 bucket_df['bucket_summary'].iloc[0], bucket_df['filename'])
+                for (query, bucket_id), bucket_df in df.groupby(['query', 'bucket_id'])
+            )
+        else:
+            with open(seed_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            buckets = (
+                (query, bucket['bucket_id'], bucket['bucket_label'], bucket['bucket_title'],
+                 bucket['bucket_summary'], [article['filename'] for article in bucket['articles']])
+                for query, query_data in data.items()
+                for bucket in query_data['buckets']
+            )
+
+        for query, bucket_id, bucket_label, title, summary, filenames in buckets:
+            if pd.isna(title) or pd.isna(summary) or is_fallback(bucket_label, title, summary):
+                continue
+            yield (query, int(bucket_id), article_set_hash(filenames)), (title, summary)
+
+    def _ensure_loaded(self):
+        if self._results is None:
+            with self._lock:
+                if self._results is None:
+                    self._load()
+
+    def get(self, query, bucket_id, filenames):
+        """(title, summary) of a bucket with exactly these articles, or None"""
+        self._ensure_loaded()
+        return self._results.get((query, int(bucket_id), article_set_hash(filenames)))
+
+    def put(self, query, bucket_id, filenames, title, summary):
+        """Record a bucket's title and summary, appending it to the results log"""
+        self._ensure_loaded()
+        key = (query, int(bucket_id), article_set_hash(filenames))
+        line = self._record_line(key, (title, summary))
+        with self._lock:
+            self._results[key] = (title, summary)
+            if self._log is None:
+                self._log = open(self.results_file, 'a', encoding='utf-8')
+            self._log.write(line)
+            self._log.flush()
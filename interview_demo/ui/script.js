@@ -41,9 +41,9 @@ async function runQuery(query) {
         addLog(`📌 Created <span class="highlight">${periods.bucketCount}</span> time periods`);
         addLog('');
 
-        // Step 3: Generate summaries
+        // Step 3: Generate summaries, drawing each period on the timeline as soon as it is ready
         addLog('Generating period summaries...');
-        const enrichedData = await generateSummaries(periods);
+        const enrichedData = await generateSummaries(periods, partialData => showTimeline(partialData, false));
         addLog('📌 Period summaries complete');
         addLog('');
         
@@ -87,9 +87,10 @@ async function organizePeriods(searchResults) {
     };
 }
 
-async function generateSummaries(periods) {
+async function generateSummaries(periods, onUpdate) {
     // THIS IS WHERE THE REAL CLAUDE API CALLS HAPPEN!
-    const response = await fetch('http://localhost:5000/api/enrich', {
+    // Buckets are streamed back as NDJSON lines, each one as soon as its summary is ready
+    const response = await fetch('http://localhost:5000/api/enrich/stream', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
@@ -97,7 +98,44 @@ async function generateSummaries(periods) {
         body: JSON.stringify({ query: periods.query })
     });
     
-    const data = await response.json();
+    // Periods without a summary yet are shown as pending points
+    const data = {
+        query: periods.query,
+        buckets: periods.buckets.map(bucket => ({
+            ...bucket,
+            bucket_title: 'Summarizing...',
+            bucket_summary: '',
+            articles: [],
+            pending: true
+        }))
+    };
+    onUpdate(data);
+    
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        buffered += decoder.decode(value, { stream: !done });
+        
+        // Keep the trailing partial line for the next chunk
+        const lines = buffered.split('\n');
+        buffered = lines.pop();
+        for (const line of lines) {
+            if (!line.trim()) continue;
+            const event = JSON.parse(line);
+            if (event.type !== 'bucket') continue;
+            
+            const index = data.buckets.findIndex(bucket => bucket.bucket_id === event.bucket.bucket_id);
+            if (index === -1) {
+                data.buckets.push(event.bucket);
+            } else {
+                data.buckets[index] = event.bucket;
+            }
+            onUpdate(data);
+        }
+        if (done) break;
+    }
     return data;
 }
 
@@ -106,7 +144,7 @@ async function buildTimeline(data) {
     showTimeline(data);
 }
 
-function showTimeline(data) {
+function showTimeline(data, scroll = true) {
     const timelineContainer = document.getElementById('timelineContainer');
     const timelineTitle = document.getElementById('timelineTitle');
     const timeline = document.getElementById('timeline');
@@ -126,7 +164,8 @@ function showTimeline(data) {
     line.className = 'timeline-line';
     timeline.appendChild(line);
     
-    // Create tooltip
+    // Create tooltip, replacing the one from a previous render
+    document.querySelectorAll('.timeline-tooltip').forEach(previous => previous.remove());
     const tooltip = document.createElement('div');
     tooltip.className = 'timeline-tooltip';
     document.body.appendChild(tooltip);
@@ -137,7 +176,7 @@ function showTimeline(data) {
     // Create timeline points
     data.buckets.forEach((bucket, index) => {
         const point = document.createElement('div');
-        point.className = 'timeline-point';
+        point.className = bucket.pending ? 'timeline-point pending' : 'timeline-point';
         
         // Position along the timeline
         const position = ((index + 0.5) / bucketCount) * 100;
@@ -180,14 +219,16 @@ function showTimeline(data) {
         
         // Click to expand
         point.addEventListener('click', () => {
-            showBucketDetails(bucket);
+            if (!bucket.pending) showBucketDetails(bucket);
         });
         
         timeline.appendChild(point);
     });
     
     // Scroll to timeline
-    timelineContainer.scrollIntoView({ behavior: 'smooth', block: 'nearest' });
+    if (scroll) {
+        timelineContainer.scrollIntoView({ behavior: 'smooth', block: 'nearest' });
+    }
 }
 
 function updateTooltipPosition(event, tooltip) {
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+# Persistent, content-addressed cache for llm results.
+# Keys are hashes of everything that determines a response (model, prompt template version,
+# document id(s) and query), so repeated runs of the same query cost no tokens.
+
+CACHE_PATH      = "data/llm_cache.sqlite"
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+
+def make_key(kind, model, prompt_version, doc_id, query):
+    """
+    Hash the inputs of an llm call into a cache key.
+
+    Args:
+        kind:           the call being cached, e.g. "extract" or "context"
+        model:          model name the call is made with
+        prompt_version: version of the prompt template; bump it whenever the prompt changes
+        doc_id:         document id, or a list of document ids for multi-document prompts
+        query:          the search query
+    """
+    if isinstance(doc_id, (list, tuple)):
+        doc_id = "\x1f".join(str(i) for i in doc_id)
+    material = "\x1e".join([kind, model, str(prompt_version), str(doc_id), query])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class LLMCache():
+    """
+    SQLite backed key -> json value store with size bounded LRU eviction.
+
+    Args:
+        path:      sqlite file to store results in, or ":memory:"
+        max_bytes: once stored values exceed this size, least recently used rows are evicted
+    """
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_CACHE_BYTES):
+        self.path      = path
+        self.max_bytes = max_bytes
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+
+        # enrichment calls the cache from worker threads
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS results (
+                key       TEXT PRIMARY KEY,
+                value     TEXT NOT NULL,
+                size      INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def get(self, key):
+        """Returns the cached value for key, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return json.loads(row[0])
+
+    def set(self, key, value):
+        """Stores a json serializable value under key, evicting old rows if over budget."""
+        data = json.dumps(value)
+        size = len(data.encode("utf-8"))
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+            if old is not None:
+                self._size -= old[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, data, size, time.time()),
+            )
+            self._size += size
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        while self._size > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM results ORDER BY last_used ASC LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._size <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                self._size -= size
+                self.evictions += 1
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def stats(self):
+        return {
+            "hits":      self.hits,
+            "misses":    self.misses,
+            "evictions": self.evictions,
+            "entries":   len(self),
+            "bytes":     self._size,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,8 +1,25 @@
+from bisect import bisect_left, bisect_right
 from datetime import timedelta
 
-from datetime import timedelta
+from data.shape import EntryBatch
+
+# cluster_by_content: adjacent periods whose mean embeddings are at least this similar are merged
+MERGE_THRESHOLD  = 0.8
+MIN_CLUSTER_SIZE = 2
+
+def cluster_by_stride(entries, nb_buckets=10, dates=None):
+    """
+    Split sorted entries into {nb_buckets} equal-width periods, dropping empty ones.
 
-def cluster_by_stride(entries, nb_buckets=10):
+    Entries are sorted, so each bucket is a contiguous slice of them whose bounds are found by
+    binary search; every entry's date is converted once rather than once per bucket.
+
+    Args:
+        entries:    entries sorted by publication date, as a list or an EntryBatch
+        nb_buckets: number of periods to split the date range into
+        dates:      optional numpy datetime64 array of the entries' publication dates; for very
+                    large result sets, buckets are then sliced out of the entries directly
+    """
     if not entries:
         return {}
 
@@ -21,28 +38,143 @@ def cluster_by_stride(entries, nb_buckets=10):
     # handle short durations
     if duration < timedelta(days=30):
         label = f"{first_date} to {last_date}"
-        return {label: entries}
+        return {label: entries[:]}
 
     stride = duration / nb_buckets
-    
+
+    starts = [first_date + (stride * i) for i in range(nb_buckets)]
+    labels = [f"{b_start} to {first_date + (stride * (i + 1))}" for i, b_start in enumerate(starts)]
+
+    if dates is not None:
+        bounds = _bucket_bounds_datetime64(dates, starts, last_date)
+    else:
+        if isinstance(entries, EntryBatch):
+            ordinals = entries.dates
+        else:
+            ordinals = [entry.source.publication_date.ordinal for entry in entries]
+        bounds   = _bucket_bounds(ordinals, [b_start.toordinal() for b_start in starts], last_date.toordinal())
+
+    # the very last bucket is inclusive of the last_date
     buckets = {}
-    for i in range(nb_buckets):
-        b_start = first_date + (stride * i)
-        b_end   = first_date + (stride * (i + 1))
-        
-        label = f"{b_start} to {b_end}"
-        buckets[label] = []
-        
-        for entry in entries:
-            entry_date = entry.source.publication_date.to_python_datetime()
-            
-            # the very last bucket is inclusive of the last_date
-            if i == nb_buckets - 1:
-                if b_start <= entry_date <= last_date:
-                    buckets[label].append(entry)
-            else:
-                if b_start <= entry_date < b_end:
-                    buckets[label].append(entry)
-        
+    for i, label in enumerate(labels):
+        buckets[label] = entries[bounds[i]:bounds[i + 1]]
+
     # drop empty clusters
     return {k: v for k, v in buckets.items() if v}
+
+
+def _bucket_bounds(ordinals, start_ordinals, last_ordinal):
+    """Index of the first entry of each bucket, followed by the end of the last bucket."""
+    bounds = [bisect_left(ordinals, start) for start in start_ordinals]
+    bounds.append(bisect_right(ordinals, last_ordinal))
+    return bounds
+
+
+def _bucket_bounds_datetime64(dates, starts, last_date):
+    import numpy as np
+
+    dates  = np.asarray(dates).astype("datetime64[D]")
+    starts = np.array(starts + [last_date], dtype="datetime64[D]")
+
+    bounds = np.searchsorted(dates, starts[:-1], side="left").tolist()
+    bounds.append(int(np.searchsorted(dates, starts[-1], side="right")))
+    return bounds
+
+
+def cluster_by_content(entries, max_clusters=10, embeddings=None, merge_threshold=MERGE_THRESHOLD,
+                       min_size=MIN_CLUSTER_SIZE):
+    """
+    Split sorted entries into periods that follow the coverage instead of a fixed stride.
+
+    The timeline is first cut at the density valleys between peaks of publication, then adjacent
+    periods are merged, most similar content first (cosine of their mean embeddings), while there
+    are more than {max_clusters} periods, periods smaller than {min_size}, or neighbours more similar
+    than {merge_threshold}. Like cluster_by_stride, every cluster is a contiguous slice of entries.
+
+    Args:
+        entries:         entries sorted by publication date, as a list or an EntryBatch
+        max_clusters:    maximum number of periods
+        embeddings:      optional array of unit-norm entry embeddings, computed with embed.py otherwise
+        merge_threshold: cosine similarity above which adjacent periods are merged
+        min_size:        periods with fewer entries are merged into their most similar neighbour
+    """
+    import numpy as np
+    from embed import embed_texts, entry_texts
+
+    if not entries:
+        return {}
+
+    if isinstance(entries, EntryBatch):
+        ordinals = np.asarray(entries.dates, dtype=np.int64)
+    else:
+        ordinals = np.array([entry.source.publication_date.ordinal for entry in entries], dtype=np.int64)
+    if embeddings is None:
+        embeddings = embed_texts(entry_texts(entries))
+
+    bounds = _density_valleys(ordinals, max_clusters)
+    bounds = _merge_similar(np.asarray(embeddings, dtype=np.float32), bounds, max_clusters, merge_threshold, min_size)
+    print(f"The search results form {len(bounds) - 1} content periods.")
+
+    clusters = {}
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        first_date = entries[start].source.publication_date.to_python_datetime()
+        last_date  = entries[end - 1].source.publication_date.to_python_datetime()
+        clusters[f"{first_date} to {last_date}"] = entries[start:end]
+    return clusters
+
+
+def _density_valleys(ordinals, max_clusters):
+    """
+    Index of the first entry of each period, followed by the number of entries, cutting the
+    timeline at the lowest point of a gaussian smoothed daily count between consecutive peaks.
+    """
+    import numpy as np
+
+    span = int(ordinals[-1] - ordinals[0])
+    if span < 30:
+        return [0, len(ordinals)]
+
+    days      = ordinals - ordinals[0]
+    counts    = np.bincount(days).astype(np.float64)
+    bandwidth = max(3.0, span / (4 * max_clusters))
+    radius    = min(int(3 * bandwidth), span)
+    offsets   = np.arange(-radius, radius + 1)
+    density   = np.convolve(counts, np.exp(-0.5 * (offsets / bandwidth) ** 2), mode="same")
+
+    # plateaus count once, at their left end
+    peaks = np.flatnonzero((density[1:-1] > density[:-2]) & (density[1:-1] >= density[2:])) + 1
+    cuts  = [left + int(np.argmin(density[left:right])) for left, right in zip(peaks[:-1], peaks[1:])]
+
+    bounds = np.searchsorted(days, cuts, side="left")
+    return sorted(set([0] + bounds.tolist() + [len(ordinals)]))
+
+
+def _merge_similar(embeddings, bounds, max_clusters, merge_threshold, min_size):
+    import numpy as np
+
+    starts = np.asarray(bounds[:-1])
+    sums   = np.add.reduceat(embeddings, starts, axis=0)
+    sizes  = np.diff(bounds)
+    bounds = list(bounds)
+
+    while len(sizes) > 1:
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+        similar   = np.einsum("ij,ij->i", centroids[:-1], centroids[1:])
+        # on ties, prefer merging the smaller pair
+        ranked    = similar - 1e-9 * (sizes[:-1] + sizes[1:])
+
+        smallest = int(np.argmin(sizes))
+        if sizes[smallest] < min_size:
+            neighbours = [i for i in (smallest - 1, smallest) if 0 <= i < len(ranked)]
+            pair = max(neighbours, key=lambda i: ranked[i])
+        elif len(sizes) > max_clusters or similar.max() >= merge_threshold:
+            pair = int(np.argmax(ranked))
+        else:
+            break
+
+        sums[pair]  += sums[pair + 1]
+        sizes[pair] += sizes[pair + 1]
+        sums   = np.delete(sums, pair + 1, axis=0)
+        sizes  = np.delete(sizes, pair + 1)
+        del bounds[pair + 1]
+    return bounds
@@ -1,29 +1,90 @@
+import sys
+from array    import array
 from datetime import date
+from functools import lru_cache
+
+# ordinal of 1970/1/1, the epoch of numpy's datetime64
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
 
 class Date():
+    """
+    A calendar date, stored as a single proleptic Gregorian ordinal (as in date.toordinal()),
+    so that comparing, sorting and hashing dates are integer operations.
+    """
+    __slots__ = ("ordinal",)
+
     def __init__(self, day, month, year):
-        self.day   = day
-        self.month = month
-        self.year  = year
+        self.ordinal = date(year, month, day).toordinal()
+
+    @classmethod
+    def from_ordinal(cls, ordinal):
+        instance = cls.__new__(cls)
+        instance.ordinal = ordinal
+        return instance
+
+    @property
+    def day(self):
+        return date.fromordinal(self.ordinal).day
+
+    @property
+    def month(self):
+        return date.fromordinal(self.ordinal).month
+
+    @property
+    def year(self):
+        return date.fromordinal(self.ordinal).year
 
     def __str__(self):
-        return f"{self.year}/{self.month}/{self.day}"
+        d = date.fromordinal(self.ordinal)
+        return f"{d.year}/{d.month}/{d.day}"
     
     def __repr__(self):
         return self.__str__()
-    
+
+    def __hash__(self):
+        return hash(self.ordinal)
+
+    def __eq__(self, other):
+        if not isinstance(other, Date):
+            return NotImplemented
+        return self.ordinal == other.ordinal
+
     def __lt__(self, other):
-        # sort by year, then month, then day
-        if self.year != other.year:
-            return self.year < (other.year)
-        if self.month != other.month:
-            return self.month < other.month
-        return self.day < other.day
+        return self.ordinal < other.ordinal
+
+    def __le__(self, other):
+        return self.ordinal <= other.ordinal
+
+    def __gt__(self, other):
+        return self.ordinal > other.ordinal
+
+    def __ge__(self, other):
+        return self.ordinal >= other.ordinal
     
     def to_python_datetime(self):
-        return date(self.year, self.month, self.day)
+        return date.fromordinal(self.ordinal)
+
+    def to_datetime64(self):
+        import numpy as np
+
+        return np.datetime64(self.ordinal - EPOCH_ORDINAL, "D")
+
+
+@lru_cache(maxsize=65536)
+def parse_date(date_string):
+    """
+    Parse a YYYY/MM/DD publication date. Results are cached, since a large result set
+    only spans a few thousand distinct days.
+    """
+    year, month, day = date_string.split("/")
+    return Date(day=int(day), month=int(month), year=int(year))
 
 class Source():
+    __slots__ = (
+        "summary", "extract", "filename", "keywords", "image_path", "topics",
+        "publication", "publication_date", "page", "tags", "relevant_summary", "relevant_extract",
+    )
+
     def __init__(self, summary, extract, filename, keywords, image_path, topics, publication, publication_date: Date, page, tags):
         self.summary          = summary
         self.extract          = extract
@@ -31,10 +92,10 @@ class Source():
         self.keywords         = keywords
         self.image_path       = image_path
         self.topics           = topics
-        self.publication      = publication
+        self.publication      = _intern(publication)
         self.publication_date = publication_date
         self.page             = page
-        self.tags             = tags
+        self.tags             = [_intern(tag) for tag in tags]
 
         # populated via llm call during enrichment
         # TODO (ogieva): extend search to return relevant extract
@@ -53,9 +114,12 @@ class Source():
         return self.__str__()
 
 class Entry():
-    def __init__(self, id, source: Source):
-        self.id     = id
-        self.source = source
+    __slots__ = ("id", "source", "duplicates")
+
+    def __init__(self, id, source: Source, duplicates=()):
+        self.id         = id
+        self.source     = source
+        self.duplicates = duplicates  # near-duplicate entries collapsed into this one, see dedup.py
 
     def __str__(self):
         return f"Entry(id = {self.id})\n  └── {self.source}"
@@ -64,10 +128,142 @@ class Entry():
         return self.__str__()
     
 class EnrichedCluster():
+    __slots__ = ("label", "title", "summary", "entries", "start_date", "end_date")
+
     def __init__(self, label, title, summary, entries, start_date, end_date):
         self.label      = label
         self.title      = title
         self.summary    = summary
         self.entries    = entries
         self.start_date = start_date
-        self.end_date   = end_date
\ No newline at end of file
+        self.end_date   = end_date
+
+class TimelineNode():
+    """A period of hierarchical enrichment: a month, a year or an era, see hierarchy.py"""
+    __slots__ = ("level", "label", "title", "summary", "entries", "children", "start_date", "end_date")
+
+    def __init__(self, level, label, title, summary, entries, children, start_date, end_date):
+        self.level      = level
+        self.label      = label
+        self.title      = title
+        self.summary    = summary
+        self.entries    = entries   # every entry of the period, sampled at the leaves only
+        self.children   = children  # nodes of the level below, empty for months
+        self.start_date = start_date
+        self.end_date   = end_date
+
+# text fields of each entry, stored back to back in EntryBatch's shared buffer
+BATCH_TEXT_FIELDS = ("summary", "extract", "keywords", "topics", "tags")
+
+class EntryBatch():
+    """
+    Columnar storage for a large set of search results.
+
+    Instead of one Source object per result, dates are kept as an array of ordinals, ids and
+    short metadata as lists, and the long text fields as offsets into one shared text buffer.
+    Entry objects are only built for the rows that are actually read.
+    """
+    __slots__ = ("ids", "dates", "publications", "filenames", "image_paths", "pages", "offsets", "duplicates", "_chunks", "_text")
+
+    def __init__(self):
+        self.ids          = []
+        self.dates        = array("l")
+        self.publications = []
+        self.filenames    = []
+        self.image_paths  = []
+        self.pages        = []
+        self.duplicates   = {}  # row -> entries collapsed into that row, see dedup.py
+
+        # offsets[i * len(BATCH_TEXT_FIELDS) + f] is where field f of row i starts in the buffer
+        self.offsets = array("q", [0])
+        self._chunks = []
+        self._text   = ""
+
+    def append(self, id, struct_data):
+        """Add one search result, as returned in result.document.struct_data"""
+        self.ids.append(id)
+        self.dates.append(parse_date(struct_data["publication_date"]).ordinal)
+        self.publications.append(_intern(struct_data["publication"]))
+        self.filenames.append(struct_data["filename"])
+        self.image_paths.append(struct_data["image_path"])
+        self.pages.append(struct_data["page"])
+
+        end = self.offsets[-1]
+        for field in BATCH_TEXT_FIELDS:
+            text = struct_data[field]
+            self._chunks.append(text)
+            end += len(text)
+            self.offsets.append(end)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def text(self, i, field):
+        """The text of one field (see BATCH_TEXT_FIELDS) of row i"""
+        return self._slot_text(i * len(BATCH_TEXT_FIELDS) + BATCH_TEXT_FIELDS.index(field))
+
+    def _slot_text(self, slot):
+        # appended text is only joined into the buffer once it is read
+        if self._chunks:
+            self._text   = self._text + "".join(self._chunks)
+            self._chunks = []
+        return self._text[self.offsets[slot]:self.offsets[slot + 1]]
+
+    def entry(self, i):
+        """Build the Entry for row i"""
+        source = Source(
+            summary          = self.text(i, "summary"),
+            extract          = self.text(i, "extract"),
+            filename         = self.filenames[i],
+            keywords         = self.text(i, "keywords").split(","),
+            image_path       = self.image_paths[i],
+            topics           = self.text(i, "topics").split(","),
+            publication      = self.publications[i],
+            publication_date = Date.from_ordinal(self.dates[i]),
+            page             = self.pages[i],
+            tags             = self.text(i, "tags").split(","),
+        )
+        return Entry(id=self.ids[i], source=source, duplicates=self.duplicates.get(i, ()))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.entry(i) for i in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        return self.entry(key)
+
+    def sorted_by_date(self):
+        """A new batch with the same rows, sorted by publication date"""
+        return self.take(sorted(range(len(self)), key=self.dates.__getitem__))
+
+    def take(self, rows):
+        """A new batch with the given rows, in that order"""
+        batch = EntryBatch()
+        for i in rows:
+            if i in self.duplicates:
+                batch.duplicates[len(batch)] = self.duplicates[i]
+            batch.ids.append(self.ids[i])
+            batch.dates.append(self.dates[i])
+            batch.publications.append(self.publications[i])
+            batch.filenames.append(self.filenames[i])
+            batch.image_paths.append(self.image_paths[i])
+            batch.pages.append(self.pages[i])
+
+            end   = batch.offsets[-1]
+            first = i * len(BATCH_TEXT_FIELDS)
+            for slot in range(first, first + len(BATCH_TEXT_FIELDS)):
+                batch._chunks.append(self._slot_text(slot))
+                end += self.offsets[slot + 1] - self.offsets[slot]
+                batch.offsets.append(end)
+        return batch
+
+    def dates_datetime64(self):
+        """The publication dates as a numpy datetime64[D] array, for cluster_by_stride(dates=...)"""
+        import numpy as np
+
+        days_since_epoch = np.array(self.dates, dtype=np.int64) - EPOCH_ORDINAL
+        return days_since_epoch.astype("datetime64[D]")
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
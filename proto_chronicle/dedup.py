@@ -0,0 +1,175 @@
+import string
+from itertools import chain
+
+import numpy as np
+
+from data.shape import EntryBatch
+
+# Near-duplicate collapsing of search results, before clustering and enrichment.
+#
+# The same story is often returned several times, across pages and publications. Entries are
+# compared through MinHash signatures of the word shingles of their summary and extract, and
+# LSH banding only compares entries that agree on a whole band of their signature, so grouping
+# takes roughly linear time. Each group keeps one canonical entry, the earliest published, which
+# links to the others through Entry.duplicates.
+
+NUM_PERM  = 128  # signature length
+BANDS     = 32   # BANDS * ROWS must equal NUM_PERM; entries with a jaccard similarity of 0.7
+ROWS      = 4    # share a band with odds above 99%, candidates are then checked on whole signatures
+SHINGLE   = 3    # words per shingle
+THRESHOLD = 0.7  # estimated jaccard similarity above which two entries are duplicates
+
+BLOCK_SHINGLES = 1 << 12  # shingles hashed at once, (NUM_PERM, BLOCK_SHINGLES) stays in cache
+
+# words are split on whitespace once punctuation is blanked out, which is several times faster
+# than a regex over millions of words
+PUNCTUATION = str.maketrans(dict.fromkeys(string.punctuation + "\u2018\u2019\u201c\u201d\u2013\u2014\u2026\u00ab\u00bb", " "))
+MULTIPLIERS = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9], dtype=np.uint64)
+
+
+def _texts(entries):
+    if isinstance(entries, EntryBatch):
+        return [entries.text(i, "summary") + " " + entries.text(i, "extract") for i in range(len(entries))]
+    return [f"{entry.source.summary or ''} {entry.source.extract or ''}" for entry in entries]
+
+
+def _shingles(texts):
+    """
+    Hashed word shingles of all texts, concatenated text after text as a uint64 array, and the
+    number of shingles of every text. Texts shorter than a shingle use their words. Repeated
+    shingles are kept, as they do not change a minimum.
+
+    Words are identified by their string hash rather than through a vocabulary; hashes are salted
+    per process, which is fine as signatures are only ever compared within one call.
+    """
+    tokens  = [text.split() for text in "\0".join(text.replace("\0", " ") for text in texts).lower().translate(PUNCTUATION).split("\0")]
+    lengths = np.array([len(words) for words in tokens], dtype=np.int64)
+    ids     = np.fromiter(map(hash, chain.from_iterable(tokens)), dtype=np.int64, count=int(lengths.sum())).view(np.uint64)
+    doc_of  = np.repeat(np.arange(len(texts)), lengths)
+
+    # shingles starting at every word, kept where the shingle does not run past its text
+    hashed = ids.copy()
+    for k in range(1, SHINGLE):
+        hashed[:-k] = hashed[:-k] * MULTIPLIERS[0] ^ ids[k:] * MULTIPLIERS[k % len(MULTIPLIERS)]
+    short  = lengths[doc_of] < SHINGLE
+    keep   = short | (np.arange(len(ids)) + SHINGLE <= np.cumsum(lengths)[doc_of])
+    hashed = np.where(short, ids, hashed)[keep]
+    return hashed, np.bincount(doc_of[keep], minlength=len(texts))
+
+
+def minhash_signatures(texts, num_perm=NUM_PERM, seed=0):
+    """
+    (len(texts), num_perm) uint32 array of MinHash signatures, and a mask of the texts that
+    have any shingle at all; signatures of empty texts are meaningless.
+    """
+    rng = np.random.default_rng(seed)
+    a   = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64)[:, None] | np.uint64(1)
+    b   = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)[:, None]
+
+    shingles, counts = _shingles(texts)
+    non_empty  = counts > 0
+    signatures = np.full((len(texts), num_perm), np.iinfo(np.uint32).max, dtype=np.uint32)
+
+    # multiply-shift hashing of the shingles of a block of texts at once, reduced per text;
+    # a block always holds whole texts, at least one
+    docs    = np.flatnonzero(non_empty)
+    offsets = np.r_[0, np.cumsum(counts[docs])]
+    i = 0
+    while i < len(docs):
+        j = max(i + 1, int(np.searchsorted(offsets, offsets[i] + BLOCK_SHINGLES, side="right")) - 1)
+        hashed = a * shingles[offsets[i]:offsets[j]]
+        hashed += b
+        hashed >>= np.uint64(32)
+        signatures[docs[i:j]] = np.minimum.reduceat(hashed, offsets[i:j] - offsets[i], axis=1).T
+        i = j
+    return signatures, non_empty
+
+
+def duplicate_groups(signatures, candidates, bands=BANDS, rows=ROWS, threshold=THRESHOLD):
+    """
+    Group label of every row, rows labelled alike being near-duplicates.
+
+    Args:
+        signatures: MinHash signatures, as returned by minhash_signatures
+        candidates: mask of the rows that may have duplicates
+    """
+    n       = len(signatures)
+    parents = list(range(n))
+
+    def find(x):
+        while parents[x] != x:
+            parents[x] = parents[parents[x]]
+            x = parents[x]
+        return x
+
+    rng   = np.random.default_rng(1)
+    mixer = rng.integers(1, 2 ** 63, size=rows, dtype=np.uint64) | np.uint64(1)
+    docs  = np.flatnonzero(candidates)
+    for band in range(bands):
+        keys   = (signatures[docs, band * rows:(band + 1) * rows] * mixer).sum(axis=1)
+        order  = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+
+        # within every run of equal keys, compare each entry to the run's first entry
+        run_start = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        run_of    = np.repeat(run_start, np.diff(np.r_[run_start, len(order)]))
+        others    = np.flatnonzero(np.arange(len(order)) != run_of)
+        if not len(others):
+            continue
+        pivots  = docs[order[run_of[others]]]
+        members = docs[order[others]]
+        similar = (signatures[pivots] == signatures[members]).mean(axis=1) >= threshold
+        for pivot, member in zip(pivots[similar].tolist(), members[similar].tolist()):
+            root_pivot, root_member = find(pivot), find(member)
+            if root_pivot != root_member:
+                parents[max(root_pivot, root_member)] = min(root_pivot, root_member)
+
+    return np.array([find(x) for x in range(n)])
+
+
+def collapse_duplicates(entries, threshold=THRESHOLD):
+    """
+    Keep one canonical entry per group of near-duplicates, in the original order.
+
+    The canonical entry is the earliest published of its group (the longest on ties), and the
+    others are listed in its Entry.duplicates.
+
+    Args:
+        entries:   entries as a list or an EntryBatch; an EntryBatch gives back an EntryBatch
+        threshold: estimated jaccard similarity above which two entries are duplicates
+    """
+    if len(entries) < 2:
+        return entries
+
+    texts = _texts(entries)
+    signatures, non_empty = minhash_signatures(texts)
+    groups = duplicate_groups(signatures, non_empty, threshold=threshold)
+
+    if isinstance(entries, EntryBatch):
+        ordinals = list(entries.dates)
+    else:
+        ordinals = [entry.source.publication_date.ordinal for entry in entries]
+
+    members = {}
+    for i, group in enumerate(groups.tolist()):
+        members.setdefault(group, []).append(i)
+
+    canonical = {}  # canonical row -> rows of its duplicates
+    for rows in members.values():
+        keep = min(rows, key=lambda i: (ordinals[i], -len(texts[i]), i))
+        canonical[keep] = [i for i in rows if i != keep]
+    kept = sorted(canonical)
+
+    if isinstance(entries, EntryBatch):
+        collapsed = entries.take(kept)
+        for row, i in enumerate(kept):
+            if canonical[i]:
+                collapsed.duplicates[row] = list(collapsed.duplicates.get(row, ())) + [entries.entry(d) for d in canonical[i]]
+        return collapsed
+
+    collapsed = []
+    for i in kept:
+        entry = entries[i]
+        entry.duplicates = list(entry.duplicates) + [entries[d] for d in canonical[i]]
+        collapsed.append(entry)
+    return collapsed
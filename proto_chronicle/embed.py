@@ -0,0 +1,141 @@
+import re
+
+import numpy as np
+
+from data.shape import EntryBatch
+
+# Dense, L2-normalized text embeddings of entries, for content-aware clustering.
+#
+# EMBED_MODEL names a sentence-transformers model to use when that package is installed;
+# otherwise (and by default) entries are embedded locally with TF-IDF reduced by a randomized
+# SVD, computed block by block so that the term matrix is never held densely in memory.
+
+EMBED_MODEL = None  # e.g. "all-MiniLM-L6-v2", needs sentence-transformers
+
+DIMENSIONS   = 64    # embedding size of the TF-IDF/SVD fallback
+MAX_FEATURES = 2048  # vocabulary size, most frequent terms first
+MIN_DF       = 2     # terms must appear in at least this many entries...
+MAX_DF       = 0.5   # ...and in at most this fraction of them
+BLOCK_ROWS   = 4096  # rows of the term matrix materialized at once
+
+TOKEN_PATTERN = re.compile(r"[a-z][a-z0-9]+")
+STOPWORDS = frozenset("""
+    a an and are as at be been but by for from has have he her his in is it its of on or said
+    she that the their they this to was were will with would which who
+""".split())
+
+
+def entry_texts(entries):
+    """Summary, keywords and topics of every entry, as one string each"""
+    if isinstance(entries, EntryBatch):
+        return [
+            " ".join(entries.text(i, field) for field in ("summary", "keywords", "topics"))
+            for i in range(len(entries))
+        ]
+    texts = []
+    for entry in entries:
+        source = entry.source
+        parts  = [source.summary or ""]
+        for values in (source.keywords, source.topics):
+            parts.append(" ".join(values) if isinstance(values, (list, tuple)) else str(values or ""))
+        texts.append(" ".join(parts))
+    return texts
+
+
+def embed_texts(texts, dimensions=DIMENSIONS, model=EMBED_MODEL, seed=0):
+    """
+    Embed texts as rows of a float32 array with unit (or zero) norm.
+
+    Args:
+        texts:      list of strings
+        dimensions: embedding size of the TF-IDF/SVD fallback
+        model:      sentence-transformers model name, or None for the fallback
+        seed:       seed of the randomized SVD, for reproducible clusters
+    """
+    if model is not None:
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            print(f"sentence-transformers is not installed, embedding with TF-IDF/SVD instead of {model}")
+        else:
+            vectors = SentenceTransformer(model).encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+            return vectors.astype(np.float32)
+    return _tfidf_svd(texts, dimensions, seed)
+
+
+def _tfidf_svd(texts, dimensions, seed):
+    rows, cols, counts, nb_features = _term_counts(texts)
+    n = len(texts)
+    if nb_features == 0:
+        return np.zeros((n, 1), dtype=np.float32)
+
+    # sublinear tf * smoothed idf, rows scaled to unit norm
+    df     = np.bincount(cols, minlength=nb_features)
+    idf    = np.log((1.0 + n) / (1.0 + df)) + 1.0
+    values = (1.0 + np.log(counts)) * idf[cols]
+    norms  = np.sqrt(np.bincount(rows, weights=values * values, minlength=n))
+    values = (values / np.maximum(norms[rows], 1e-12)).astype(np.float32)
+
+    # randomized range finder with one power iteration, over blocks of rows
+    k     = min(dimensions, nb_features, n)
+    rng   = np.random.default_rng(seed)
+    omega = rng.standard_normal((nb_features, k + 8)).astype(np.float32)
+    row_starts = np.searchsorted(rows, np.arange(0, n + BLOCK_ROWS, BLOCK_ROWS))
+
+    def blocks():
+        for b, start in enumerate(range(0, n, BLOCK_ROWS)):
+            lo, hi = row_starts[b], row_starts[b + 1]
+            block  = np.zeros((min(BLOCK_ROWS, n - start), nb_features), dtype=np.float32)
+            block[rows[lo:hi] - start, cols[lo:hi]] = values[lo:hi]
+            yield start, block
+
+    y = np.empty((n, k + 8), dtype=np.float32)
+    for start, block in blocks():
+        y[start:start + len(block)] = block @ omega
+    q, _ = np.linalg.qr(y)
+    z = np.zeros((nb_features, q.shape[1]), dtype=np.float32)
+    for start, block in blocks():
+        z += block.T @ q[start:start + len(block)]
+    y = np.empty_like(q)
+    for start, block in blocks():
+        y[start:start + len(block)] = block @ z
+    q, _ = np.linalg.qr(y)
+
+    small = np.zeros((q.shape[1], nb_features), dtype=np.float32)
+    for start, block in blocks():
+        small += q[start:start + len(block)].T @ block
+    u, s, _ = np.linalg.svd(small, full_matrices=False)
+
+    embeddings = (q @ u[:, :k]) * s[:k]
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return (embeddings / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+def _term_counts(texts):
+    """COO term counts (rows, cols, counts) over the selected vocabulary, sorted by row"""
+    documents = []
+    df = {}
+    for text in texts:
+        counts = {}
+        for token in TOKEN_PATTERN.findall(text.lower()):
+            if token not in STOPWORDS:
+                counts[token] = counts.get(token, 0) + 1
+        documents.append(counts)
+        for token in counts:
+            df[token] = df.get(token, 0) + 1
+
+    max_df     = max(MIN_DF, MAX_DF * len(texts))
+    candidates = [token for token, count in df.items() if MIN_DF <= count <= max_df]
+    candidates.sort(key=lambda token: (-df[token], token))
+    vocabulary = {token: i for i, token in enumerate(candidates[:MAX_FEATURES])}
+
+    rows, cols, counts = [], [], []
+    for row, document in enumerate(documents):
+        for token, count in document.items():
+            col = vocabulary.get(token)
+            if col is not None:
+                rows.append(row)
+                cols.append(col)
+                counts.append(count)
+    return (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64),
+            np.array(counts, dtype=np.float64), len(vocabulary))
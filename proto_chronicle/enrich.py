@@ -1,53 +1,196 @@
 import anthropic
-import json
-import random
-from data.shape import EnrichedCluster
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from cache           import LLMCache, make_key
+from data.shape      import EnrichedCluster, TimelineNode
+from sample          import make_sampler, text_terms
+from utils.responses import TOOL_NAME, ResponseError, request_fields
+from utils.tokens    import estimate_tokens, split_by_budget, truncate_to_tokens
+from utils.tracing   import tracer
 
 MODEL  = "claude-sonnet-4-20250514"
 
+# bump these whenever the corresponding prompt changes, to invalidate cached results
+EXTRACT_PROMPT_VERSION = 2
+CONTEXT_PROMPT_VERSION = 2
+MERGE_PROMPT_VERSION   = 2
+
 client = anthropic.Anthropic()
-def enrich_clusters(clusters, query):
-    enriched_clusters = {}
-    for date, entries in clusters.items():
-        title   = ""
-        summary = ""
-        
-        # pick {nb_samples} random articles from each cluster
-        # nb_samples = 2
-        # random_indexes = set()
-        # for i in range(nb_samples):
-        #     random_indexes.add(i)
-        # sampled_entries = [entries[idx] for idx in random_indexes]
-
-        # extract relevant parts of the article, and make llm call for context
-        print("Extracting and summarizing relevant documents....")
-        print(f"\nTime period: {date}")
-        for entry in entries:
-            entry.source.relevant_extract = extract_relevant_portions(entry, query)
-            print(f"\n----> Entry: {entry.source.filename}")
-            print(f"-----------> Relevant Extract: \n-----------> {entry.source.relevant_extract}")
-        title, summary = generate_bucket_context(query, entries, date)
-        
-        enriched_clusters[date] = EnrichedCluster(
-            label=date,
-            title=title,
-            summary=summary,
-            entries=entries,
-            start_date=entries[0].source.publication_date,
-            end_date=entries[0].source.publication_date,
-        )
+
+# set to None to always call the model
+cache = LLMCache()
+
+# maximum number of llm calls in flight at once
+MAX_WORKERS = 8
+
+# large clusters are sampled before any llm call: "spread", "top" or "mmr" (see sample.py),
+# or None to send every entry. The budget is in input tokens of the extraction calls.
+SAMPLER             = "spread"
+SAMPLE_TOKEN_BUDGET = 24000
+MAX_SAMPLES         = 20
+
+# estimated input tokens per prompt. A document over budget is truncated; a cluster over budget
+# is split into consecutive parts that are summarized separately, then merged (map-reduce)
+EXTRACT_INPUT_BUDGET = 6000   # summary and extract of one document
+ENTRY_TOKEN_BUDGET   = 1500   # one entry's relevant extract, or one period's summary, in a prompt
+CONTEXT_INPUT_BUDGET = 12000  # entries of one context prompt
+MERGE_INPUT_BUDGET   = 12000  # periods of one merge prompt
+PROMPT_OVERHEAD      = 30     # filename, labels and separators around each entry or period
+
+# title of the placeholder context of a period whose summary failed
+FALLBACK_TITLE = "Results for '{query}'"
+
+# fields of the answers, requested through tool use (see utils/responses.py)
+EXTRACT_FIELDS = {"relevant_extract": "The portions of the article text that relate to the query"}
+CONTEXT_FIELDS = {
+    "title":   "A brief, descriptive title (5-10 words) capturing the key themes",
+    "summary": "A complete paragraph summary synthesizing the main patterns, events, and themes",
+}
+
+def enrich_clusters(clusters, query, max_workers=MAX_WORKERS):
+    """
+    Extract relevant portions from every entry and generate a title and summary per cluster.
+
+    Extraction calls for all clusters run concurrently on a bounded thread pool, and each
+    cluster's summary call is scheduled as soon as that cluster's own extractions are done.
+    The returned clusters are identical to, and in the same order as, a sequential run.
+
+    Args:
+        clusters:    dict of label -> list of entries, as returned by cluster_by_stride
+        query:       the search query the entries were retrieved for
+        max_workers: maximum number of concurrent llm calls
+    """
+    if not clusters:
+        return {}
+
+    print("Extracting and summarizing relevant documents....")
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        samples = {
+            date: sample_entries(entries, query)
+            for date, entries in clusters.items()
+        }
+        contexts = {
+            date: schedule_cluster(pool, query, date, samples[date])
+            for date in clusters
+        }
+
+        enriched_clusters = {}
+        for date, entries in clusters.items():
+            title, summary = contexts[date].result()
+
+            print(f"\nTime period: {date}")
+            if len(samples[date]) < len(entries):
+                print(f"Sampled {len(samples[date])} of {len(entries)} entries")
+            for entry in samples[date]:
+                print(f"\n----> Entry: {entry.source.filename}")
+                print(f"-----------> Relevant Extract: \n-----------> {entry.source.relevant_extract}")
+
+            enriched_clusters[date] = EnrichedCluster(
+                label=date,
+                title=title,
+                summary=summary,
+                entries=entries,
+                start_date=entries[0].source.publication_date,
+                end_date=entries[0].source.publication_date,
+            )
     return enriched_clusters
 
 
+def sample_entries(entries, query, strategy=SAMPLER, budget=SAMPLE_TOKEN_BUDGET, max_samples=MAX_SAMPLES):
+    """
+    The entries of one cluster that are sent to the llm, in their original order.
+
+    Args:
+        entries:     entries of the cluster
+        query:       the search query, used to score entries for the "top" and "mmr" strategies
+        strategy:    name of a sampler from sample.py, or None to keep every entry
+        budget:      input token budget of the cluster's extraction calls
+        max_samples: maximum number of entries to keep
+    """
+    if strategy is None:
+        return list(entries)
+
+    query_terms = set(query.lower().split())
+
+    def score(entry):
+        words = [entry.source.summary or ""] + list(entry.source.keywords or []) + list(entry.source.topics or [])
+        terms = set(" ".join(words).lower().split())
+        return len(query_terms & terms) / (len(query_terms) or 1)
+
+    sampler = make_sampler(
+        strategy,
+        date=lambda entry: entry.source.publication_date.ordinal,
+        score=score,
+        terms=lambda entry: text_terms(entry.source.keywords, entry.source.topics),
+        cost=lambda entry: min(EXTRACT_INPUT_BUDGET, estimate_tokens(entry.source.summary) + estimate_tokens(entry.source.extract)),
+    )
+    return sampler.select(entries, budget=budget, max_items=max_samples)
+
+
+def schedule_cluster(pool, query, date, entries):
+    """
+    Submit extraction calls for every entry of one cluster, and chain the cluster's
+    context generation call onto the last of them.
+
+    Returns a future resolving to the cluster's (title, summary).
+
+    Args:
+        pool:    executor the calls are submitted to, shared by every cluster
+        query:   the search query the entries were retrieved for
+        date:    label of the cluster, e.g. its date range
+        entries: the cluster's entries, already sampled
+    """
+    context = Future()
+    pending = [len(entries)]
+    lock    = threading.Lock()
+
+    def extract(entry):
+        entry.source.relevant_extract = extract_relevant_portions(entry, query)
+
+    def on_context_done(future):
+        if future.exception() is not None:
+            context.set_exception(future.exception())
+        else:
+            context.set_result(future.result())
+
+    def on_extract_done(_):
+        with lock:
+            pending[0] -= 1
+            if pending[0] > 0:
+                return
+        failed = [f.exception() for f in extractions if f.exception() is not None]
+        if failed:
+            context.set_exception(failed[0])
+            return
+        pool.submit(generate_bucket_context, query, entries, date).add_done_callback(on_context_done)
+
+    extractions = [pool.submit(extract, entry) for entry in entries]
+    if not extractions:
+        pool.submit(generate_bucket_context, query, entries, date).add_done_callback(on_context_done)
+    for future in extractions:
+        future.add_done_callback(on_extract_done)
+    return context
+
+
 def extract_relevant_portions(entry, query):
+    key = make_key("extract", MODEL, EXTRACT_PROMPT_VERSION, entry.id, query)
+    if cache is not None:
+        cached = cache.get(key)
+        tracer.cache("extract", cached is not None)
+        if cached is not None:
+            return cached
+
+    summary = truncate_to_tokens(entry.source.summary, EXTRACT_INPUT_BUDGET // 4)
+    extract = truncate_to_tokens(entry.source.extract, EXTRACT_INPUT_BUDGET - estimate_tokens(summary))
 
     prompt = f"""You are analyzing an archived Nigerian newspaper article retrieved for the query: "{query}"
 
         DOCUMENT:
         Filename: {entry.source.filename}
         Publication: {entry.source.publication} ({entry.source.publication_date})
-        Full Summary: {entry.source.summary}
-        Full Extract: {entry.source.extract}
+        Full Summary: {summary}
+        Full Extract: {extract}
 
         TASK:
         Extract ONLY the portions of the article text that directly relate to "{query}"
@@ -55,39 +198,55 @@ def extract_relevant_portions(entry, query):
         - Keep enough context to be understandable
         - If the entire article is relevant, include it all
 
-        Return ONLY valid JSON (no markdown, no backticks):
-        {{
-            "relevant_extract": "extracted text here",
-        }}"""
+        Record the extracted text with the {TOOL_NAME} tool."""
 
     try:
-        response = client.messages.create(
+        result = request_fields(
+            client,
+            EXTRACT_FIELDS,
+            kind="extract",
             model=MODEL,
             max_tokens=1000,
             messages=[{"role": "user", "content": prompt}]
         )
-        
-        result = json.loads(response.content[0].text)
-        
-        if 'relevant_extract' not in result:
-            raise KeyError("Missing required fields in response")
-            
+
+        if cache is not None:
+            cache.set(key, result['relevant_extract'])
         return result['relevant_extract']
         
-    except (json.JSONDecodeError, KeyError) as e:
+    except ResponseError as e:
         print(f"Error extracting from {entry.source.filename}: {e}")
-        # Fallback: return original content
-        return entry.source.summary, entry.source.extract
+        # Fallback: the original text, within the budget of one entry of a context prompt
+        return truncate_to_tokens(entry.source.extract or entry.source.summary, ENTRY_TOKEN_BUDGET)
+
+
+def _extract_key(entry):
+    digest = hashlib.blake2b(str(entry.source.relevant_extract).encode("utf-8"), digest_size=8).hexdigest()
+    return f"{entry.id}\x1d{digest}"
 
 
 def generate_bucket_context(query, entries, dates):
+    # keyed on the extracts as well as the entries: a context built on a fallback extract must
+    # not be served once the extraction succeeds
+    key = make_key("context", MODEL, CONTEXT_PROMPT_VERSION, [dates] + [_extract_key(entry) for entry in entries], query)
+    if cache is not None:
+        cached = cache.get(key)
+        tracer.cache("context", cached is not None)
+        if cached is not None:
+            return tuple(cached)
+
+    extracts = [truncate_to_tokens(entry.source.relevant_extract, ENTRY_TOKEN_BUDGET) for entry in entries]
+    costs    = [estimate_tokens(extract) + PROMPT_OVERHEAD for extract in extracts]
+    if len(entries) > 1 and sum(costs) > CONTEXT_INPUT_BUDGET:
+        return _map_reduce_context(query, entries, dates, costs)
+
     # Build entries text more efficiently
     entries_text = []
-    for i, entry in enumerate(entries, 1):
+    for i, (entry, extract) in enumerate(zip(entries, extracts), 1):
         entries_text.append(f"""
             Entry {i}:
             Filename: {entry.source.filename}
-            Extract: {entry.source.relevant_extract}
+            Extract: {extract}
             ---""")
     
     context_generation_prompt = f"""You are analyzing {len(entries)} archived Nigerian newspapers from {dates} returned for the query: "{query}"
@@ -99,24 +258,149 @@ def generate_bucket_context(query, entries, dates):
         ENTRIES:
         {''.join(entries_text)}
 
-        Return ONLY valid JSON (no markdown, no backticks):
-        {{
-            "title": "your title here",
-            "summary": "your summary here"
-        }}"""
+        Record the title and summary with the {TOOL_NAME} tool."""
     
     try:
-        response = client.messages.create(
-        model=MODEL,
-        max_tokens=1000,
-        messages=[{"role": "user", "content": context_generation_prompt}]
-         )
-    
-        result = json.loads(response.content[0].text)
-        if 'title' not in result or 'summary' not in result:
-            raise KeyError("Missing required fields in response")
+        result = request_fields(
+            client,
+            CONTEXT_FIELDS,
+            kind="context",
+            model=MODEL,
+            max_tokens=1000,
+            messages=[{"role": "user", "content": context_generation_prompt}]
+        )
+
+        if cache is not None:
+            cache.set(key, [result['title'], result['summary']])
         return result['title'], result['summary']
         
-    except (json.JSONDecodeError, KeyError, IndexError) as e:
+    except ResponseError as e:
         print(f"Error generating context: {e}")
-        return f"Results for '{query}'", f"Collection of {len(entries)} articles from {dates} related to {query}."
\ No newline at end of file
+        return _fallback_context(query, len(entries), dates)
+
+
+def _map_reduce_context(query, entries, dates, costs):
+    """
+    Title and summary of a cluster too large for one context prompt: its entries are split, in
+    order, into parts within CONTEXT_INPUT_BUDGET, every part is summarized on its own and the
+    part summaries are merged. Each call is cached like any other.
+
+    Parts run one after the other on the calling worker: concurrency across clusters already
+    comes from the caller's pool, and the scheduler bounds the calls in flight.
+    """
+    parts = split_by_budget(list(range(len(entries))), costs.__getitem__, CONTEXT_INPUT_BUDGET)
+    parts = [[entries[i] for i in part] for part in parts]
+    print(f"Splitting {len(entries)} entries from {dates} into {len(parts)} parts")
+
+    def label(part):
+        return f"{part[0].source.publication_date} to {part[-1].source.publication_date}"
+
+    contexts = [generate_bucket_context(query, part, label(part)) for part in parts]
+
+    nodes = [
+        TimelineNode(
+            level="part",
+            label=label(part),
+            title=title,
+            summary=summary,
+            entries=part,
+            children=[],
+            start_date=part[0].source.publication_date,
+            end_date=part[-1].source.publication_date,
+        )
+        for part, (title, summary) in zip(parts, contexts)
+    ]
+    return merge_summaries(query, nodes, dates)
+
+
+def merge_summaries(query, children, label):
+    """
+    Title and summary of a period from the titles and summaries of its sub-periods.
+
+    Results are cached on the children's own titles and summaries, so a period is only
+    summarized again when one of its sub-periods changed.
+
+    Args:
+        query:    the search query the entries were retrieved for
+        children: the sub-periods, as TimelineNodes in date order
+        label:    label of the period, e.g. "2015" or "2010 to 2014"
+    """
+    key = make_key("merge", MODEL, MERGE_PROMPT_VERSION,
+                   [label] + [f"{child.label}\x1d{child.title}\x1d{child.summary}" for child in children], query)
+    if cache is not None:
+        cached = cache.get(key)
+        tracer.cache("merge", cached is not None)
+        if cached is not None:
+            return tuple(cached)
+
+    summaries = [truncate_to_tokens(child.summary, ENTRY_TOKEN_BUDGET) for child in children]
+    costs     = [estimate_tokens(child.title) + estimate_tokens(summary) + PROMPT_OVERHEAD
+                 for child, summary in zip(children, summaries)]
+    if sum(costs) > MERGE_INPUT_BUDGET:
+        groups = split_by_budget(list(range(len(children))), costs.__getitem__, MERGE_INPUT_BUDGET)
+        if len(groups) < len(children):
+            # merge consecutive periods within the budget first, then merge those
+            merged = []
+            for group in groups:
+                group = [children[i] for i in group]
+                if len(group) == 1:
+                    merged.append(group[0])
+                    continue
+                group_label = f"{group[0].label} to {group[-1].label}"
+                title, summary = merge_summaries(query, group, group_label)
+                merged.append(TimelineNode(
+                    level=group[0].level,
+                    label=group_label,
+                    title=title,
+                    summary=summary,
+                    entries=[entry for child in group for entry in child.entries],
+                    children=group,
+                    start_date=group[0].start_date,
+                    end_date=group[-1].end_date,
+                ))
+            return merge_summaries(query, merged, label)
+
+    children_text = []
+    for child, summary in zip(children, summaries):
+        children_text.append(f"""
+            Period: {child.label} ({len(child.entries)} articles)
+            Title: {child.title}
+            Summary: {summary}
+            ---""")
+
+    merge_prompt = f"""You are analyzing archived Nigerian newspapers from {label} returned for the query: "{query}"
+        The coverage has already been summarized period by period, in chronological order.
+
+        Generate a comprehensive analysis of the whole of {label}:
+        1. A brief, descriptive title (5-10 words) capturing the key themes
+        2. A complete paragraph summary synthesizing how events and themes developed across the periods
+
+        PERIODS:
+        {''.join(children_text)}
+
+        Record the title and summary with the {TOOL_NAME} tool."""
+
+    try:
+        result = request_fields(
+            client,
+            CONTEXT_FIELDS,
+            kind="merge",
+            model=MODEL,
+            max_tokens=1000,
+            messages=[{"role": "user", "content": merge_prompt}]
+        )
+
+        # a merge of placeholder periods is recomputed once they are summarized for real
+        placeholders = [child for child in children if child.title == FALLBACK_TITLE.format(query=query)]
+        if cache is not None and not placeholders:
+            cache.set(key, [result['title'], result['summary']])
+        return result['title'], result['summary']
+
+    except ResponseError as e:
+        print(f"Error merging summaries of {label}: {e}")
+        return _fallback_context(query, sum(len(child.entries) for child in children), label)
+
+
+def _fallback_context(query, nb_articles, label):
+    """Placeholder title and summary of a period whose context generation failed"""
+    return FALLBACK_TITLE.format(query=query), f"Collection of {nb_articles} articles from {label} related to {query}."
@@ -0,0 +1,112 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools          import groupby
+
+from data.shape import TimelineNode
+from enrich     import MAX_WORKERS, merge_summaries, sample_entries, schedule_cluster
+
+# Hierarchical enrichment: entries are summarized month by month, then the month summaries are
+# merged into year summaries, and the year summaries into era summaries.
+#
+# Months only depend on their own entries and every level above only on the titles and summaries
+# of its children, so all months are summarized in parallel, then all years, then all eras. Every
+# node is cached on exactly those inputs (see enrich.py): adding a document to a month recomputes
+# that month, its year and its era, and zooming the timeline between levels costs no calls.
+
+LEVELS    = ("month", "year", "era")
+ERA_YEARS = 5  # eras are aligned spans of this many years, e.g. 2010 to 2014
+
+
+def _month_label(date):
+    return f"{date.year}-{date.month:02d}"
+
+
+def _year_label(date):
+    return str(date.year)
+
+
+def _era_label(date, era_years=ERA_YEARS):
+    start = date.year - date.year % era_years
+    return f"{start} to {start + era_years - 1}"
+
+
+def enrich_hierarchy(entries, query, era_years=ERA_YEARS, max_workers=MAX_WORKERS):
+    """
+    Enrich sorted entries as a tree of months, years and eras.
+
+    Returns the era nodes in date order; their children are years, whose children are months.
+    A period with a single child takes its child's title and summary instead of another call.
+
+    Args:
+        entries:     entries sorted by publication date, as a list or an EntryBatch
+        query:       the search query the entries were retrieved for
+        era_years:   number of years per era
+        max_workers: maximum number of concurrent llm calls
+    """
+    if not len(entries):
+        return []
+
+    entries = list(entries[:])
+    months  = [
+        (label, list(group))
+        for label, group in groupby(entries, key=lambda entry: _month_label(entry.source.publication_date))
+    ]
+
+    print(f"Summarizing {len(months)} months....")
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        contexts = {
+            label: schedule_cluster(pool, query, label, sample_entries(month_entries, query))
+            for label, month_entries in months
+        }
+        nodes = []
+        for label, month_entries in months:
+            title, summary = contexts[label].result()
+            nodes.append(_node("month", label, title, summary, month_entries, []))
+
+        years = _merge_level(pool, query, nodes, "year", lambda node: _year_label(node.start_date))
+        eras  = _merge_level(pool, query, years, "era", lambda node: _era_label(node.start_date, era_years))
+    return eras
+
+
+def _merge_level(pool, query, children, level, label_of):
+    """Group consecutive nodes by label_of and merge every group into a node of {level}"""
+    groups = [(label, list(group)) for label, group in groupby(children, key=label_of)]
+    print(f"Merging into {len(groups)} {level}s....")
+
+    merges = {
+        label: pool.submit(merge_summaries, query, group, label)
+        for label, group in groups if len(group) > 1
+    }
+    nodes = []
+    for label, group in groups:
+        if label in merges:
+            title, summary = merges[label].result()
+        else:
+            title, summary = group[0].title, group[0].summary
+        entries = [entry for child in group for entry in child.entries]
+        nodes.append(_node(level, label, title, summary, entries, group))
+    return nodes
+
+
+def _node(level, label, title, summary, entries, children):
+    return TimelineNode(
+        level=level,
+        label=label,
+        title=title,
+        summary=summary,
+        entries=entries,
+        children=children,
+        start_date=entries[0].source.publication_date,
+        end_date=entries[-1].source.publication_date,
+    )
+
+
+def nodes_at(roots, level):
+    """
+    The nodes of one level of the tree, as a dict of label -> node in date order, e.g. to
+    show the timeline zoomed in to months or out to eras.
+    """
+    depth = LEVELS.index("era") - LEVELS.index(level)
+    nodes = list(roots)
+    for _ in range(depth):
+        nodes = [child for node in nodes for child in node.children]
+    return {node.label: node for node in nodes}
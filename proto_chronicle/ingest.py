@@ -0,0 +1,231 @@
+import argparse
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.fix_json import CHUNK_BYTES, GZIP_LEVEL, SHARD_BYTES, ShardWriter, convert_line, load_entry, read_chunks, vertex_id
+
+# Incremental ingestion of the archive dump.
+#
+# Every document's _source is fingerprinted, and the fingerprints of the previous run are kept
+# in a manifest. Each run only emits what changed since, into a timestamped delta directory:
+#   upserts-00000.jsonl[.gz], ...  added and changed documents, Vertex formatted, for an
+#                                  INCREMENTAL Discovery Engine import
+#   deletes.jsonl                  {"id": ...} of every document that left the dump
+# and can apply the same delta to a local index (see local_search.apply_delta).
+#
+#   python ingest.py data/dump.json --local-index data/local_index --gzip
+
+MANIFEST_PATH = "data/ingest_manifest.sqlite"
+DELTA_DIR     = "data/delta"
+
+
+def fingerprint(source_data):
+    """
+    Content hash of a document's _source. Keys are sorted and the stdlib encoder is used
+    whatever codec parses the dump, so that fingerprints are stable from run to run.
+    """
+    encoded = json.dumps(source_data, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(encoded.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def fingerprint_chunk(chunk):
+    """
+    (id, fingerprint, start, end) of every document of a chunk of whole dump lines, where
+    chunk[start:end] is the document's line, and the number of malformed lines skipped.
+    Runs in a worker process.
+    """
+    records = []
+    skipped = 0
+    start   = 0
+    for line in chunk.splitlines(keepends=True):
+        end = start + len(line)
+        if line.strip():
+            try:
+                entry_data = load_entry(line)
+            except ValueError:
+                skipped += 1
+            else:
+                records.append((vertex_id(entry_data), fingerprint(entry_data.get("_source", {})), start, end))
+        start = end
+    return records, skipped
+
+
+class Manifest():
+    """
+    SQLite table of the fingerprint of every ingested document, by Vertex id.
+
+    Args:
+        path: sqlite file to keep the manifest in, or ":memory:"
+    """
+    def __init__(self, path=MANIFEST_PATH):
+        self.path  = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS documents (
+                id          TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+    def fingerprints(self):
+        """id -> fingerprint of every document of the last run"""
+        return dict(self._conn.execute("SELECT id, fingerprint FROM documents"))
+
+    def update(self, upserts, deleted):
+        """Record a run's added / changed (id, fingerprint) pairs and deleted ids, atomically"""
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO documents (id, fingerprint) VALUES (?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET fingerprint = excluded.fingerprint",
+                upserts,
+            )
+            self._conn.executemany("DELETE FROM documents WHERE id = ?", ((doc_id,) for doc_id in deleted))
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+
+def new_run_dir(output_dir):
+    """
+    Create and return a delta directory of its own for this run, named by its start time, with a
+    sequence number when another run started in the same second, e.g. 20250101-120000-1.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    for sequence in itertools.count():
+        run_dir = os.path.join(output_dir, stamp if sequence == 0 else f"{stamp}-{sequence}")
+        try:
+            os.makedirs(run_dir, exist_ok=False)
+        except FileExistsError:
+            continue
+        return run_dir
+
+
+def ingest(input_file, manifest_path=MANIFEST_PATH, output_dir=DELTA_DIR, index_dir=None, workers=None,
+           chunk_bytes=CHUNK_BYTES, shard_bytes=SHARD_BYTES, compress=False):
+    """
+    Diff a dump against the manifest, write the delta and record the new fingerprints.
+
+    Args:
+        input_file:    path to the raw dump, one json document per line
+        manifest_path: sqlite manifest of the previous run's fingerprints
+        output_dir:    directory in which each run writes a timestamped delta directory
+        index_dir:     optional local index to apply the delta to
+        workers:       number of worker processes, defaults to the number of cpus
+        chunk_bytes:   input bytes fingerprinted per task
+        shard_bytes:   size after which a new upserts shard is started
+        compress:      gzip the upserts shards
+
+    Returns (upsert shard paths, deletes path or None). The manifest is only updated once
+    the delta is written and applied, so an interrupted run can simply be started again.
+    """
+    workers  = workers or os.cpu_count() or 1
+    manifest = Manifest(manifest_path)
+    previous = manifest.fingerprints()  # what is left in it at the end was deleted
+    run_dir  = new_run_dir(output_dir)
+
+    writer     = ShardWriter(os.path.join(run_dir, "upserts.jsonl"), shard_bytes, compress)
+    upserts    = []
+    start      = time.perf_counter()
+    read_bytes = 0
+    nb_docs    = 0
+    nb_added   = 0
+    nb_skipped = 0
+
+    def write_changes(chunk, records):
+        nonlocal nb_docs, nb_added
+        lines = []
+        for doc_id, doc_fingerprint, line_start, line_end in records:
+            nb_docs += 1
+            old = previous.pop(doc_id, None)
+            if old == doc_fingerprint:
+                continue
+            nb_added += old is None
+            lines.append(convert_line(chunk[line_start:line_end]))
+            upserts.append((doc_id, doc_fingerprint))
+        if lines:
+            data = b"".join(lines)
+            writer.write(gzip.compress(data, compresslevel=GZIP_LEVEL) if compress else data)
+
+    print(f"Fingerprinting {input_file} against {len(previous)} known documents with {workers} workers....")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # keep a bounded number of chunks in flight, and diff them in input order
+        pending = []
+        for chunk in read_chunks(input_file, chunk_bytes):
+            read_bytes += len(chunk)
+            pending.append((chunk, pool.submit(fingerprint_chunk, chunk)))
+            if len(pending) >= 2 * workers:
+                chunk, future = pending.pop(0)
+                records, skipped = future.result()
+                write_changes(chunk, records)
+                nb_skipped += skipped
+        for chunk, future in pending:
+            records, skipped = future.result()
+            write_changes(chunk, records)
+            nb_skipped += skipped
+    writer.close()
+
+    deleted      = sorted(previous)
+    deletes_path = None
+    if deleted:
+        deletes_path = os.path.join(run_dir, "deletes.jsonl")
+        with open(deletes_path, "w", encoding="utf-8") as f:
+            for doc_id in deleted:
+                f.write(json.dumps({"id": doc_id}) + "\n")
+
+    elapsed = time.perf_counter() - start
+    print(f"Scanned {nb_docs} documents ({read_bytes / 1e6:.1f}MB) in {elapsed:.1f}s: "
+          f"{read_bytes / 1e6 / elapsed:.1f}MB/s, {nb_docs / elapsed:.0f} docs/s")
+    print(f"{nb_added} added, {len(upserts) - nb_added} changed, {len(deleted)} deleted")
+    if nb_skipped:
+        print(f"Skipped {nb_skipped} malformed lines")
+
+    if not writer.paths and not deleted:
+        os.rmdir(run_dir)
+        print("Nothing to ingest")
+        manifest.close()
+        return [], None
+
+    if index_dir is not None:
+        from local_search import apply_delta
+        masked = apply_delta(index_dir, writer.paths, deleted)
+        print(f"Applied delta to {index_dir} ({masked} stale documents masked)")
+
+    manifest.update(upserts, deleted)
+    manifest.close()
+    print(f"Delta written to {run_dir}")
+    return writer.paths, deletes_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Emit the added, changed and deleted documents of the archive dump")
+    parser.add_argument("input_file", nargs="?", default="data/dump.json")
+    parser.add_argument("--manifest", default=MANIFEST_PATH, help="fingerprints of the previous run")
+    parser.add_argument("--output-dir", default=DELTA_DIR, help="where to write delta directories")
+    parser.add_argument("--local-index", default=None, help="local index directory to apply the delta to")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: cpu count)")
+    parser.add_argument("--chunk-mb", type=float, default=CHUNK_BYTES / 1024 / 1024, help="input MB per task")
+    parser.add_argument("--shard-mb", type=float, default=SHARD_BYTES / 1024 / 1024, help="MB per upserts shard")
+    parser.add_argument("--gzip", action="store_true", help="gzip the upserts shards")
+    args = parser.parse_args()
+
+    ingest(
+        args.input_file,
+        manifest_path=args.manifest,
+        output_dir=args.output_dir,
+        index_dir=args.local_index,
+        workers=args.workers,
+        chunk_bytes=int(args.chunk_mb * 1024 * 1024),
+        shard_bytes=int(args.shard_mb * 1024 * 1024),
+        compress=args.gzip,
+    )
@@ -0,0 +1,444 @@
+import argparse
+import gzip
+import json
+import mmap
+import os
+import re
+import shutil
+import time
+from array import array
+
+import numpy as np
+
+from data.shape    import parse_date
+from search_filter import facet_values
+
+# Local BM25 search over the formatted_dump shards written by utils/fix_json.py, as an
+# offline alternative to Discovery Engine.
+#
+# The index is a directory of flat binary files that are memory-mapped at query time:
+#   meta.json          document count, average length, bm25 parameters and field weights
+#   lexicon.bin        every term, utf-8 encoded, back to back in sorted order
+#   lexicon.idx        per term: (term offset, postings offset, postings count) as uint64
+#   postings_docs.bin  document numbers of every posting, uint32
+#   postings_tfs.bin   field weighted term frequency of every posting, float32
+#   doclens.bin        field weighted length of every document, float32
+#   dates.bin          publication date ordinal of every document, int32 (0 if unknown)
+#   docs.bin           every document as a json line {"id": ..., "structData": ...}
+#   docs.idx           byte offset of every document in docs.bin, uint64
+#   ids.txt            id of every document, one per line
+#
+# Incremental updates (see ingest.py) are applied as delta segments: subdirectories with the
+# same files, listed oldest first in segments.json. A segment's deleted.bin holds the document
+# numbers (uint32) that were changed or deleted by a later delta. Segments are searched together,
+# with collection statistics summed across them; a full build_index drops every delta.
+
+INDEX_DIR = "data/local_index"
+
+SEGMENTS_FILE = "segments.json"
+DELETED_FILE  = "deleted.bin"
+
+# how much a term occurrence counts for in each field
+FIELD_WEIGHTS = {
+    "summary":  2.0,
+    "extract":  1.0,
+    "keywords": 3.0,
+    "topics":   2.5,
+    "tags":     1.5,
+}
+
+# fields whose exact values get posting lists, for SearchFilter; their terms are prefixed
+# with a NUL byte so that they can never collide with query tokens
+FACET_FIELDS = ("publication", "tags", "page")
+
+K1 = 1.2
+B  = 0.75
+
+TOKEN_PATTERN = re.compile(r"\w+")
+STOPWORDS = frozenset("""
+    a an and are as at be but by for from has have in is it its of on or that the their
+    this to was were will with
+""".split())
+
+
+def tokenize(text):
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def facet_term(field, value):
+    return f"\x00{field}:{value}"
+
+
+def _field_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        return " ".join(str(v) for v in value)
+    return str(value)
+
+
+def _read_lines(jsonl_paths):
+    for jsonl_path in jsonl_paths:
+        opener = gzip.open if jsonl_path.endswith(".gz") else open
+        with opener(jsonl_path, "rt", encoding="utf-8") as infile:
+            yield from infile
+
+
+def build_index(jsonl_path, index_dir=INDEX_DIR, field_weights=FIELD_WEIGHTS):
+    """
+    Build a local index from Vertex formatted jsonl files.
+
+    Args:
+        jsonl_path:    path to a formatted_dump jsonl file, or a list of shards; .gz shards are decompressed
+        index_dir:     directory to write the index files to
+        field_weights: weight of each indexed field of structData
+    """
+    postings = {}  # term -> (array of doc numbers, array of weighted tfs)
+    doclens  = array("f")
+    dates    = array("i")
+    offsets  = array("Q")
+    ids      = []
+
+    jsonl_paths = [jsonl_path] if isinstance(jsonl_path, str) else list(jsonl_path)
+
+    os.makedirs(index_dir, exist_ok=True)
+    _drop_deltas(index_dir)
+    with open(os.path.join(index_dir, "docs.bin"), "wb") as docs_file:
+
+        for line in _read_lines(jsonl_paths):
+            if not line.strip():
+                continue
+            document = json.loads(line)
+            doc      = len(doclens)
+
+            struct_data = document.get("structData", {})
+            frequencies = {}
+            length      = 0.0
+            for field, weight in field_weights.items():
+                tokens  = tokenize(_field_text(struct_data.get(field)))
+                length += weight * len(tokens)
+                for token in tokens:
+                    frequencies[token] = frequencies.get(token, 0.0) + weight
+            for field in FACET_FIELDS:
+                for value in facet_values(field, struct_data.get(field)):
+                    frequencies.setdefault(facet_term(field, value), 0.0)
+
+            for term, frequency in frequencies.items():
+                if term not in postings:
+                    postings[term] = (array("I"), array("f"))
+                postings[term][0].append(doc)
+                postings[term][1].append(frequency)
+            doclens.append(length)
+            dates.append(_date_ordinal(struct_data.get("publication_date")))
+
+            ids.append(str(document.get("id")))
+            offsets.append(docs_file.tell())
+            docs_file.write((json.dumps({"id": document.get("id"), "structData": struct_data}) + "\n").encode("utf-8"))
+
+    _write_index(index_dir, postings, doclens, dates, offsets, ids, field_weights)
+    return len(doclens)
+
+
+def _date_ordinal(value):
+    try:
+        return parse_date(value).ordinal
+    except (AttributeError, ValueError):
+        return 0
+
+
+def _write_index(index_dir, postings, doclens, dates, offsets, ids, field_weights):
+    lexicon = array("Q")
+    with open(os.path.join(index_dir, "lexicon.bin"), "wb") as lexicon_file, \
+         open(os.path.join(index_dir, "postings_docs.bin"), "wb") as docs_file, \
+         open(os.path.join(index_dir, "postings_tfs.bin"), "wb") as tfs_file:
+
+        term_offset    = 0
+        posting_offset = 0
+        for term in sorted(postings, key=lambda t: t.encode("utf-8")):
+            docs, tfs = postings[term]
+            encoded   = term.encode("utf-8")
+
+            lexicon.extend((term_offset, posting_offset, len(docs)))
+            lexicon_file.write(encoded)
+            docs.tofile(docs_file)
+            tfs.tofile(tfs_file)
+
+            term_offset    += len(encoded)
+            posting_offset += len(docs)
+        lexicon.append(term_offset)
+
+    with open(os.path.join(index_dir, "lexicon.idx"), "wb") as f:
+        lexicon.tofile(f)
+    with open(os.path.join(index_dir, "doclens.bin"), "wb") as f:
+        doclens.tofile(f)
+    with open(os.path.join(index_dir, "dates.bin"), "wb") as f:
+        dates.tofile(f)
+    with open(os.path.join(index_dir, "docs.idx"), "wb") as f:
+        offsets.tofile(f)
+    with open(os.path.join(index_dir, "ids.txt"), "w", encoding="utf-8") as f:
+        f.write("".join(doc_id + "\n" for doc_id in ids))
+
+    with open(os.path.join(index_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "nb_docs":       len(doclens),
+            "nb_terms":      len(postings),
+            "avg_doclen":    (sum(doclens) / len(doclens)) if doclens else 0.0,
+            "k1":            K1,
+            "b":             B,
+            "field_weights": field_weights,
+        }, f, indent=2)
+
+
+def _segment_dirs(index_dir):
+    """The index's segment directories, the full build first and then its deltas, oldest first"""
+    segments_path = os.path.join(index_dir, SEGMENTS_FILE)
+    if not os.path.exists(segments_path):
+        return [index_dir]
+    with open(segments_path, "r", encoding="utf-8") as f:
+        return [index_dir] + [os.path.join(index_dir, name) for name in json.load(f)]
+
+
+def _drop_deltas(index_dir):
+    for segment_dir in _segment_dirs(index_dir)[1:]:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+    for name in (SEGMENTS_FILE, DELETED_FILE):
+        if os.path.exists(os.path.join(index_dir, name)):
+            os.remove(os.path.join(index_dir, name))
+
+
+def _read_ids(segment_dir):
+    with open(os.path.join(segment_dir, "ids.txt"), "r", encoding="utf-8") as f:
+        return f.read().splitlines()
+
+
+def apply_delta(index_dir, upsert_paths, deleted_ids, field_weights=None):
+    """
+    Apply an incremental update to an existing index: upserted documents go into a new delta
+    segment, and their previous versions, along with deleted documents, are masked out.
+
+    Args:
+        index_dir:    directory of an index written by build_index
+        upsert_paths: Vertex formatted jsonl files (or .gz shards) of added and changed documents
+        deleted_ids:  ids of deleted documents
+
+    Returns the number of documents masked out of older segments.
+    """
+    if field_weights is None:
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            field_weights = json.load(f)["field_weights"]
+
+    segments = _segment_dirs(index_dir)
+    stale    = set(deleted_ids)
+    names    = [os.path.basename(segment_dir) for segment_dir in segments[1:]]
+
+    if upsert_paths:
+        name = f"delta-{len(segments):05d}"
+        build_index(upsert_paths, os.path.join(index_dir, name), field_weights)
+        stale.update(_read_ids(os.path.join(index_dir, name)))
+    else:
+        name = None
+
+    masked = 0
+    for segment_dir in segments:
+        deleted_path = os.path.join(segment_dir, DELETED_FILE)
+        deleted = array("I")
+        if os.path.exists(deleted_path):
+            with open(deleted_path, "rb") as f:
+                deleted.frombytes(f.read())
+        already = set(deleted)
+        for doc, doc_id in enumerate(_read_ids(segment_dir)):
+            if doc_id in stale and doc not in already:
+                deleted.append(doc)
+                masked += 1
+        with open(deleted_path + ".tmp", "wb") as f:
+            deleted.tofile(f)
+        os.replace(deleted_path + ".tmp", deleted_path)
+
+    # the new segment only becomes visible once every older copy is masked
+    if name is not None:
+        segments_path = os.path.join(index_dir, SEGMENTS_FILE)
+        with open(segments_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(names + [name], f, indent=2)
+        os.replace(segments_path + ".tmp", segments_path)
+    return masked
+
+
+def _map(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class _Segment():
+    """Memory-mapped files of one segment directory"""
+    def __init__(self, segment_dir):
+        with open(os.path.join(segment_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.nb_docs = self.meta["nb_docs"]
+
+        self._lexicon_terms = _map(os.path.join(segment_dir, "lexicon.bin"))
+        self._lexicon       = np.frombuffer(_map(os.path.join(segment_dir, "lexicon.idx")), dtype=np.uint64)
+        self._postings_docs = np.frombuffer(_map(os.path.join(segment_dir, "postings_docs.bin")), dtype=np.uint32)
+        self._postings_tfs  = np.frombuffer(_map(os.path.join(segment_dir, "postings_tfs.bin")), dtype=np.float32)
+        self.doclens        = np.frombuffer(_map(os.path.join(segment_dir, "doclens.bin")), dtype=np.float32)
+        self.dates          = np.frombuffer(_map(os.path.join(segment_dir, "dates.bin")), dtype=np.int32)
+        self._docs          = _map(os.path.join(segment_dir, "docs.bin"))
+        self._doc_offsets   = np.frombuffer(_map(os.path.join(segment_dir, "docs.idx")), dtype=np.uint64)
+
+        self.live = np.ones(self.nb_docs, dtype=bool)
+        deleted_path = os.path.join(segment_dir, DELETED_FILE)
+        if os.path.exists(deleted_path):
+            self.live[np.fromfile(deleted_path, dtype=np.uint32)] = False
+
+        self._nb_terms = self.meta["nb_terms"]
+
+    def _term(self, i):
+        # the next term's offset, or the trailing end offset for the last term
+        start = int(self._lexicon[3 * i])
+        end   = int(self._lexicon[3 * (i + 1)])
+        return self._lexicon_terms[start:end]
+
+    def postings(self, term):
+        """(doc numbers, weighted tfs) of a term, found by binary search over the lexicon"""
+        encoded = term.encode("utf-8")
+        lo, hi  = 0, self._nb_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < encoded:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == self._nb_terms or self._term(lo) != encoded:
+            return None
+        offset = int(self._lexicon[3 * lo + 1])
+        count  = int(self._lexicon[3 * lo + 2])
+        return self._postings_docs[offset:offset + count], self._postings_tfs[offset:offset + count]
+
+    def document(self, doc):
+        start = int(self._doc_offsets[doc])
+        end   = self._docs.find(b"\n", start)
+        record = json.loads(self._docs[start:end])
+        return record["id"], record["structData"]
+
+
+class LocalIndex():
+    """
+    Read-only view of an index written by build_index, and of its delta segments. Files are
+    memory-mapped, so opening an index is cheap and only the postings of the query terms are
+    ever read. Document numbers run across segments, oldest first.
+    """
+    def __init__(self, index_dir=INDEX_DIR):
+        self._segments = [_Segment(segment_dir) for segment_dir in _segment_dirs(index_dir)]
+        self.meta      = self._segments[0].meta
+        self.nb_docs   = sum(segment.nb_docs for segment in self._segments)
+
+        # first document number of every segment
+        self._bases = np.cumsum([0] + [segment.nb_docs for segment in self._segments])[:-1]
+        if len(self._segments) == 1:
+            self._doclens = self._segments[0].doclens
+            self._dates   = self._segments[0].dates
+        else:
+            self._doclens = np.concatenate([segment.doclens for segment in self._segments])
+            self._dates   = np.concatenate([segment.dates for segment in self._segments])
+        self._live       = np.concatenate([segment.live for segment in self._segments])
+        self._avg_doclen = sum(segment.meta["avg_doclen"] * segment.nb_docs for segment in self._segments) / (self.nb_docs or 1)
+
+    def postings(self, term):
+        """(doc numbers, weighted tfs) of a term across every segment, or None"""
+        found = [
+            (docs.astype(np.int64) + base, tfs)
+            for segment, base in zip(self._segments, self._bases)
+            for docs, tfs in [segment.postings(term) or (None, None)]
+            if docs is not None
+        ]
+        if not found:
+            return None
+        if len(found) == 1:
+            return found[0]
+        return np.concatenate([docs for docs, _ in found]), np.concatenate([tfs for _, tfs in found])
+
+    def filter_mask(self, search_filter):
+        """Boolean mask over document numbers of the documents passing a SearchFilter"""
+        mask = np.ones(self.nb_docs, dtype=bool)
+        if search_filter.start_date is not None:
+            mask &= self._dates >= search_filter.start_date.ordinal
+        if search_filter.end_date is not None:
+            mask &= self._dates <= search_filter.end_date.ordinal
+
+        for field, values in search_filter.facets():
+            allowed = np.zeros(self.nb_docs, dtype=bool)
+            for value in values:
+                found = self.postings(facet_term(field, value))
+                if found is not None:
+                    allowed[found[0]] = True
+            mask &= allowed
+        return mask
+
+    def search(self, query, limit=None, candidates=None):
+        """
+        Rank documents against query with bm25.
+
+        Args:
+            query:      free text query
+            limit:      return at most this many documents, or None for every match
+            candidates: optional boolean mask over document numbers; other documents are skipped
+
+        Returns a list of (document number, score), best first.
+        """
+        k1, b   = self.meta["k1"], self.meta["b"]
+        avgdl   = self._avg_doclen or 1.0
+        scores  = np.zeros(self.nb_docs, dtype=np.float32)
+        matched = np.zeros(self.nb_docs, dtype=bool)
+
+        for term in set(tokenize(query)):
+            found = self.postings(term)
+            if found is None:
+                continue
+            docs, tfs = found
+            idf  = np.log(1.0 + (self.nb_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = k1 * (1.0 - b + b * self._doclens[docs] / avgdl)
+            scores[docs]  += idf * tfs * (k1 + 1.0) / (tfs + norm)
+            matched[docs]  = True
+
+        matched &= self._live
+        if candidates is not None:
+            matched &= candidates
+        hits = np.flatnonzero(matched)
+        if limit is not None and limit < len(hits):
+            hits = hits[np.argpartition(-scores[hits], limit)[:limit]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(int(doc), float(scores[doc])) for doc in hits]
+
+    def document(self, doc):
+        """(id, structData) of a document number"""
+        segment = int(np.searchsorted(self._bases, doc, side="right")) - 1
+        return self._segments[segment].document(doc - int(self._bases[segment]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the local search index")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="index formatted_dump jsonl files or shards")
+    build.add_argument("jsonl_path", nargs="+")
+    build.add_argument("--index-dir", default=INDEX_DIR)
+
+    query = commands.add_parser("query", help="run a query against an index")
+    query.add_argument("query")
+    query.add_argument("--index-dir", default=INDEX_DIR)
+    query.add_argument("--limit", type=int, default=10)
+
+    args = parser.parse_args()
+    if args.command == "build":
+        start = time.perf_counter()
+        nb_docs = build_index(args.jsonl_path, args.index_dir)
+        print(f"Indexed {nb_docs} documents into {args.index_dir} in {time.perf_counter() - start:.1f}s")
+    else:
+        index = LocalIndex(args.index_dir)
+        start = time.perf_counter()
+        hits  = index.search(args.query, limit=args.limit)
+        print(f"{len(hits)} results in {(time.perf_counter() - start) * 1000:.1f}ms")
+        for doc, score in hits:
+            doc_id, struct_data = index.document(doc)
+            print(f"{score:7.3f}  {doc_id}  {struct_data.get('filename')}")
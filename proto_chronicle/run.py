@@ -1,86 +1,125 @@
-from cluster       import cluster_by_stride
-from data.shape    import Source, Entry, Date
-from enrich        import enrich_clusters
-from search        import search_data_dump
-from utils.helpers import convertToDate
+from cluster       import cluster_by_content, cluster_by_stride
+from data.shape    import EntryBatch
+from dedup         import collapse_duplicates
+from enrich        import enrich_clusters, cache
+from hierarchy     import enrich_hierarchy
+from search        import search_pages, SearchFilter
+from utils.tracing import tracer
 
 QUERY = "Election crises and violence"
+PAGE_SIZE   = 10
+MAX_RESULTS = None  # cap on the total number of search results, None for all
+
+# e.g. SearchFilter(start_date="2015/01/01", end_date="2019/12/31", publications=["Vanguard"])
+SEARCH_FILTER = None
+
+# "stride" splits the date range into equal periods; "content", opt-in, follows the coverage
+# instead (see cluster.py)
+CLUSTERING = "stride"
+
+# "clusters" summarizes every cluster on its own, "hierarchy" summarizes months and merges them
+# into years and eras (see hierarchy.py)
+ENRICHMENT = "clusters"
+
+# every stage and llm call of the run is traced to data/traces/<run id>.jsonl
+tracer.start_run(QUERY)
 
 # Search
 print(f"Running search for `{QUERY}`...")
-page_result = search_data_dump(search_query=QUERY, fake=True)
-responses = []
-try:
-    for result in page_result:
-        id     = result.document.id
-        source = Source(
-            summary           = result.document.struct_data["summary"],
-            extract           = result.document.struct_data["extract"],
-            filename          = result.document.struct_data["filename"],
-            keywords          = result.document.struct_data["keywords"].split(","),
-            image_path        = result.document.struct_data["image_path"],
-            topics            = result.document.struct_data["topics"].split(","),
-            publication       = result.document.struct_data["publication"],
-            publication_date  = convertToDate(result.document.struct_data["publication_date"]),
-            page              = result.document.struct_data["page"],
-            tags              = result.document.struct_data["tags"].split(","),
-        )
-
-        response = Entry(
-            id     = id,
-            source = source,
-        )
-        responses.append(response)
-
-except Exception as e:
-    print(f"Retrieval error: {e}")
+# each page is parsed while the next one is being fetched
+batch = EntryBatch()
+with tracer.stage("search") as span:
+    try:
+        for page in search_pages(search_query=QUERY, fake=True, page_size=PAGE_SIZE, max_results=MAX_RESULTS, search_filter=SEARCH_FILTER):
+            for result in page:
+                batch.append(id=result.document.id, struct_data=result.document.struct_data)
+
+    except Exception as e:
+        print(f"Retrieval error: {e}")
+        span["error"] = str(e)
+    span["results"] = len(batch)
 print("Done!")
 
-nb_results = len(responses)
+nb_results = len(batch)
 print(f"Retrieved {nb_results} results.")
 
 # Sort
 print("\n")
 print("Sorting results by publication_date...")
-responses.sort(key=lambda x: x.source.publication_date.to_python_datetime())
+with tracer.stage("sort"):
+    responses = batch.sorted_by_date()
 print("Done!")
 
-# Cluster
+# Deduplicate
 print("\n")
-print("Clustering results...")
-clusters = cluster_by_stride(entries=responses)
+print("Collapsing near-duplicate results...")
+with tracer.stage("dedup") as span:
+    responses = collapse_duplicates(responses)
+    span["duplicates"] = nb_results - len(responses)
 print("Done!")
+print(f"Kept {len(responses)} of {nb_results} results.")
 
-print("Clusters formed:")
-for date, entries in clusters.items():
-    print(f"{date}: {len(entries)} articles.")
-    for entry in entries:
-        print(f"---------> {entry.source.filename}")
+# Cluster; the hierarchy groups entries by month itself
+if ENRICHMENT != "hierarchy":
+    print("\n")
+    print("Clustering results...")
+    with tracer.stage("cluster") as span:
+        if CLUSTERING == "content":
+            clusters = cluster_by_content(entries=responses)
+        else:
+            clusters = cluster_by_stride(entries=responses)
+        span["clusters"] = len(clusters)
+    print("Done!")
+
+    print("Clusters formed:")
+    for date, entries in clusters.items():
+        print(f"{date}: {len(entries)} articles.")
+        for entry in entries:
+            print(f"---------> {entry.source.filename}")
 
 # Enrichment
 print("\n")
 print("--------------------------------------------------------------")
-print("Enriching clusters with context...")
-enriched_clusters = enrich_clusters(clusters=clusters, query=QUERY)
+print("Enriching results with context...")
+with tracer.stage("enrich") as span:
+    if ENRICHMENT == "hierarchy":
+        eras = enrich_hierarchy(entries=responses, query=QUERY)
+        span["eras"] = len(eras)
+    else:
+        enriched_clusters = enrich_clusters(clusters=clusters, query=QUERY)
+        span["clusters"] = len(enriched_clusters)
 print("Done!")
+if cache is not None:
+    print(f"LLM cache: {cache.stats()}")
 
 print("\n RESULTS FINAL")
-print("Enriched Clusters:")
-for date, enriched_cluster in enriched_clusters.items():
-    print("\n")
-    print(f"--> Enriched Cluster {enriched_cluster.label}:")
-    print(f"------> Titled `{enriched_cluster.title}`")
-    print(f"------> Summary: {enriched_cluster.summary}")
-    print(f"------> Compiled from {len(enriched_cluster.entries)} sources")
-    for entry in enriched_cluster.entries:
-            print(f"-----------> {entry.source.filename}")
+if ENRICHMENT == "hierarchy":
+    print("Enriched Timeline:")
+    def print_node(node, depth=0):
+        indent = "    " * depth
+        print(f"{indent}--> {node.level.capitalize()} {node.label}: `{node.title}` ({len(node.entries)} sources)")
+        print(f"{indent}------> Summary: {node.summary}")
+        for child in node.children:
+            print_node(child, depth + 1)
+
+    for era in eras:
+        print("\n")
+        print_node(era)
+else:
+    print("Enriched Clusters:")
+    for date, enriched_cluster in enriched_clusters.items():
+        print("\n")
+        print(f"--> Enriched Cluster {enriched_cluster.label}:")
+        print(f"------> Titled `{enriched_cluster.title}`")
+        print(f"------> Summary: {enriched_cluster.summary}")
+        print(f"------> Compiled from {len(enriched_cluster.entries)} sources")
+        for entry in enriched_cluster.entries:
+                print(f"-----------> {entry.source.filename}")
+                for duplicate in entry.duplicates:
+                    print(f"-----------> {duplicate.source.filename} (duplicate)")
 
 # Visualize
 
-
-
-
-
-
-
-
+print("\n")
+print(f"Run trace written to {tracer.path}")
+print(tracer.summary())
@@ -0,0 +1,163 @@
+import re
+from abc import ABC, abstractmethod
+
+# Representative sampling of large buckets before they are sent to the llm.
+#
+# A sampler ranks a bucket's items from most to least wanted, and select() takes items in
+# that order for as long as they fit the budget (in tokens, images, or any other cost unit).
+# Samplers only see items through accessor functions, so the same strategies work for
+# proto_chronicle entries and for interview_demo rows:
+#
+#   sampler = make_sampler("spread", date=lambda entry: entry.source.publication_date.ordinal)
+#   sampled = sampler.select(entries, budget=20000)
+
+SAMPLERS = {}
+
+
+def register(name):
+    def decorator(cls):
+        SAMPLERS[name] = cls
+        return cls
+    return decorator
+
+
+def make_sampler(name, **accessors):
+    """Build the sampler registered under {name}, e.g. "spread", "top" or "mmr"."""
+    if name not in SAMPLERS:
+        raise ValueError(f"Unknown sampler `{name}`, expected one of {sorted(SAMPLERS)}")
+    return SAMPLERS[name](**accessors)
+
+
+class Sampler(ABC):
+    """
+    Base sampler. Subclasses implement rank().
+
+    Args:
+        date:  item -> sortable date (e.g. an ordinal)
+        score: item -> relevance, higher is better, or None when unknown
+        terms: item -> set of terms describing the item (keywords, topics...)
+        cost:  item -> cost of sending the item, in the budget's unit
+    """
+    def __init__(self, date=None, score=None, terms=None, cost=None):
+        self.date  = date  or (lambda item: 0)
+        self.score = score or (lambda item: None)
+        self.terms = terms or (lambda item: set())
+        self.cost  = cost  or (lambda item: 1)
+
+    @abstractmethod
+    def rank(self, items):
+        """Indexes of items, most wanted first"""
+
+    def select(self, items, budget=None, max_items=None):
+        """
+        Take items in rank order while they fit {budget} and {max_items}; items too expensive
+        to fit are skipped in favor of cheaper ones. The selection keeps the items' original order.
+        """
+        items = list(items)
+        if (budget is None or sum(self.cost(item) for item in items) <= budget) and \
+           (max_items is None or len(items) <= max_items):
+            return items
+
+        chosen = []
+        spent  = 0
+        for i in self.rank(items):
+            if max_items is not None and len(chosen) >= max_items:
+                break
+            cost = self.cost(items[i])
+            if budget is not None and spent + cost > budget:
+                continue
+            chosen.append(i)
+            spent += cost
+        return [items[i] for i in sorted(chosen)]
+
+
+@register("spread")
+class DateSpreadSampler(Sampler):
+    """
+    Date-stratified spread: the first and last items in time come first, then the middle,
+    then the quarters, and so on, so that any prefix of the ranking covers the whole period.
+    """
+    def rank(self, items):
+        by_date = sorted(range(len(items)), key=lambda i: self.date(items[i]))
+        if len(by_date) <= 2:
+            return by_date
+
+        ranked = [by_date[0], by_date[-1]]
+        seen   = set(ranked)
+        step   = len(by_date) - 1
+        while len(ranked) < len(by_date):
+            step /= 2
+            position = step
+            while position < len(by_date) - 1:
+                i = by_date[round(position)]
+                if i not in seen:
+                    seen.add(i)
+                    ranked.append(i)
+                position += 2 * step
+            if step < 0.5:
+                ranked.extend(i for i in by_date if i not in seen)
+                break
+        return ranked
+
+
+@register("top")
+class TopScoreSampler(Sampler):
+    """Score-ranked top-k; items without a score rank last, in their original order."""
+    def rank(self, items):
+        def key(i):
+            score = self.score(items[i])
+            return (score is None, -(score or 0.0))
+        return sorted(range(len(items)), key=key)
+
+
+@register("mmr")
+class DiversitySampler(Sampler):
+    """
+    Maximal marginal relevance: repeatedly pick the item with the best trade-off between its
+    score and its term overlap (jaccard similarity) with the items already picked.
+
+    Args:
+        diversity: weight of novelty against relevance, between 0 and 1
+    """
+    def __init__(self, diversity=0.5, **accessors):
+        super().__init__(**accessors)
+        self.diversity = diversity
+
+    def rank(self, items):
+        terms  = [set(self.terms(item)) for item in items]
+        scores = [self.score(item) for item in items]
+        known  = [score for score in scores if score is not None]
+        low, high = (min(known), max(known)) if known else (0.0, 0.0)
+        relevance = [
+            1.0 if score is None or high == low else (score - low) / (high - low)
+            for score in scores
+        ]
+
+        ranked    = []
+        remaining = list(range(len(items)))
+        max_similarity = [0.0] * len(items)
+        while remaining:
+            best = max(
+                remaining,
+                key=lambda i: (1 - self.diversity) * relevance[i] - self.diversity * max_similarity[i],
+            )
+            ranked.append(best)
+            remaining.remove(best)
+            for i in remaining:
+                max_similarity[i] = max(max_similarity[i], _jaccard(terms[i], terms[best]))
+        return ranked
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def text_terms(*texts):
+    """Lowercased terms of comma separated keyword/topic strings or lists, for the mmr sampler"""
+    terms = set()
+    for text in texts:
+        values = text if isinstance(text, (list, tuple)) else re.split(r"[,;]", text or "")
+        terms.update(value.strip().lower() for value in values if value and value.strip())
+    return terms
@@ -1,23 +1,125 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
 from google.api_core.client_options import ClientOptions
 from google.cloud import discoveryengine_v1 as discoveryengine
 
+from data.shape    import parse_date
+from search_filter import SearchFilter, facet_values
+
 # Query Discovery Engine Search API for matching documents
 
 project_id = "chronicle-archiving"
 location = "global"
 engine_id = "pre-chronicle_1770424342454"
 
-def search_data_dump(search_query: str, fake=True):
-    if fake:
+# written by `python local_search.py build data/formatted_dump-*.jsonl`, kept current by ingest.py
+LOCAL_INDEX_DIR = "data/local_index"
+
+PAGE_SIZE   = 10
+MAX_RETRIES = 3
+RETRY_DELAY = 1.0  # seconds, doubled after every failed attempt
+
+def search_data_dump(search_query: str, fake=True, page_size=PAGE_SIZE, max_results=None, local=False, search_filter=None):
+    for page in search_pages(search_query, fake=fake, page_size=page_size, max_results=max_results, local=local, search_filter=search_filter):
+        yield from page
+
+
+def search_pages(search_query: str, fake=True, page_size=PAGE_SIZE, max_results=None, max_retries=MAX_RETRIES, local=False, search_filter=None):
+    """
+    Yield search results one page at a time. The next page is fetched in the background
+    while the caller processes the current one.
+
+    A page that fails is retried up to {max_retries} times with exponential backoff; if it
+    still fails the error is raised, after every earlier page has already been yielded.
+
+    Args:
+        search_query:  the query to search for
+        fake:          search the fake data instead of Discovery Engine
+        page_size:     number of results per page
+        max_results:   stop after this many results in total, or None for all of them
+        local:         search the local bm25 index at LOCAL_INDEX_DIR instead of Discovery Engine
+        search_filter: optional SearchFilter (date range, publications, tags, pages), applied
+                       by the backend so that excluded documents are never fetched
+    """
+    if local:
+        print("Returning local index data....")
+        fetch_page = _local_page_fetcher(search_query=search_query, page_size=page_size, max_results=max_results, search_filter=search_filter)
+    elif fake:
         print("Returning dummy data....")
-        return search_data_dump_FAKE()
-    print("Returning genuine data....")
-    return search_data_dump_VERTEX(search_query=search_query)
+        fetch_page = lambda page_token: search_page_FAKE(page_token=page_token, page_size=page_size, search_filter=search_filter)
+    else:
+        print("Returning genuine data....")
+        fetch_page = _vertex_page_fetcher(search_query=search_query, page_size=page_size, search_filter=search_filter)
 
+    remaining = max_results
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        next_page = prefetcher.submit(_fetch_with_retries, fetch_page, "", max_retries)
+        while next_page is not None:
+            results, next_page_token = next_page.result()
+            if remaining is not None:
+                results = results[:remaining]
+                remaining -= len(results)
 
-def search_data_dump_VERTEX(
-    search_query: str,
-) -> discoveryengine.services.search_service.pagers.SearchPager:
+            next_page = None
+            if next_page_token and (remaining is None or remaining > 0):
+                next_page = prefetcher.submit(_fetch_with_retries, fetch_page, next_page_token, max_retries)
+
+            yield results
+
+
+def _fetch_with_retries(fetch_page, page_token, max_retries):
+    for attempt in range(max_retries + 1):
+        try:
+            return fetch_page(page_token)
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            delay = RETRY_DELAY * (2 ** attempt)
+            print(f"Page fetch failed ({e}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+
+def _vertex_page_fetcher(search_query: str, page_size=PAGE_SIZE, search_filter=None):
+    """
+    Returns a function mapping a page token to that page's (results, next_page_token),
+    reusing one Discovery Engine client for every page.
+    """
+    client = _search_client()
+
+    def fetch_page(page_token):
+        pager    = search_data_dump_VERTEX(search_query, page_size=page_size, page_token=page_token, client=client, search_filter=search_filter)
+        response = next(iter(pager.pages))
+        return list(response.results), response.next_page_token
+
+    return fetch_page
+
+
+def _local_page_fetcher(search_query: str, page_size=PAGE_SIZE, max_results=None, search_filter=None):
+    """
+    Same interface as _vertex_page_fetcher, over the local index. The query is ranked once,
+    and pages are served from the ranking; page tokens are offsets, as in search_page_FAKE.
+    """
+    from local_search import LocalIndex
+
+    index = LocalIndex(LOCAL_INDEX_DIR)
+    candidates = index.filter_mask(search_filter) if search_filter is not None else None
+    hits       = index.search(search_query, limit=max_results, candidates=candidates)
+
+    def fetch_page(page_token):
+        offset = int(page_token) if page_token else 0
+        end    = offset + page_size
+        results = [
+            FakeResult(document=FakeDocument(*index.document(doc)))
+            for doc, _ in hits[offset:end]
+        ]
+        return results, (str(end) if end < len(hits) else "")
+
+    return fetch_page
+
+
+def _search_client():
     #  For more information, refer to:
     # https://cloud.google.com/generative-ai-app-builder/docs/locations#specify_a_multi-region_for_your_data_store
     client_options = (
@@ -25,9 +127,19 @@ def search_data_dump_VERTEX(
         if location != "global"
         else None
     )
+    return discoveryengine.SearchServiceClient(client_options=client_options)
 
+
+def search_data_dump_VERTEX(
+    search_query: str,
+    page_size=PAGE_SIZE,
+    page_token="",
+    client=None,
+    search_filter=None,
+) -> discoveryengine.services.search_service.pagers.SearchPager:
     # Create a client
-    client = discoveryengine.SearchServiceClient(client_options=client_options)
+    if client is None:
+        client = _search_client()
 
     # The full resource name of the search app serving config
     serving_config = f"projects/{project_id}/locations/{location}/collections/default_collection/engines/{engine_id}/servingConfigs/default_config"
@@ -62,7 +174,9 @@ def search_data_dump_VERTEX(
     request = discoveryengine.SearchRequest(
         serving_config=serving_config,
         query=search_query,
-        page_size=10,
+        page_size=page_size,
+        page_token=page_token,
+        filter=search_filter.to_vertex_expression() if search_filter is not None else "",
         content_search_spec=content_search_spec,
         query_expansion_spec=discoveryengine.SearchRequest.QueryExpansionSpec(
             condition=discoveryengine.SearchRequest.QueryExpansionSpec.Condition.AUTO,
@@ -385,4 +499,50 @@ def search_data_dump_FAKE():
         doc = FakeDocument(id=data["id"], struct_data=data)
         results.append(FakeResult(document=doc))
     
-    return results
\ No newline at end of file
+    return results
+
+
+def search_page_FAKE(page_token="", page_size=PAGE_SIZE, search_filter=None):
+    """
+    One page of the fake results, paged like Discovery Engine: the page token is the
+    offset of the page's first result, and an empty next token marks the last page.
+    """
+    results = search_data_dump_FAKE()
+    if search_filter is not None:
+        results = [results[i] for i in _fake_candidates(search_filter)]
+    offset  = int(page_token) if page_token else 0
+    end     = offset + page_size
+    next_page_token = str(end) if end < len(results) else ""
+    return results[offset:end], next_page_token
+
+
+@lru_cache(maxsize=1)
+def _fake_postings():
+    """Date ordinals and facet posting lists of the fake results, computed once"""
+    ordinals = []
+    postings = {}
+    for i, result in enumerate(search_data_dump_FAKE()):
+        struct_data = result.document.struct_data
+        ordinals.append(parse_date(struct_data["publication_date"]).ordinal)
+        for field in ("publication", "tags", "page"):
+            for value in facet_values(field, struct_data.get(field)):
+                postings.setdefault((field, value), set()).add(i)
+    return ordinals, postings
+
+
+def _fake_candidates(search_filter):
+    """Positions of the fake results passing search_filter, in their original order"""
+    ordinals, postings = _fake_postings()
+    start = search_filter.start_date.ordinal if search_filter.start_date is not None else None
+    end   = search_filter.end_date.ordinal if search_filter.end_date is not None else None
+
+    candidates = {
+        i for i, ordinal in enumerate(ordinals)
+        if (start is None or ordinal >= start) and (end is None or ordinal <= end)
+    }
+    for field, values in search_filter.facets():
+        allowed = set()
+        for value in values:
+            allowed |= postings.get((field, value), set())
+        candidates &= allowed
+    return sorted(candidates)
\ No newline at end of file
@@ -0,0 +1,83 @@
+from data.shape     import Date, parse_date
+from utils.fix_json import date_field, facet_field, facet_values, normalize_facet
+
+class SearchFilter():
+    """
+    Structured restrictions applied by the search backend, before any result is returned.
+    Every field is optional; a document must satisfy all fields that are set.
+
+    Args:
+        start_date:   earliest publication date, inclusive, as a Date or "YYYY/MM/DD"
+        end_date:     latest publication date, inclusive, as a Date or "YYYY/MM/DD"
+        publications: publication names, any of which may match, e.g. ["Vanguard", "Punch"]
+        tags:         tags, any of which may match
+        pages:        page numbers, any of which may match, e.g. ["1"] for front pages
+    """
+    def __init__(self, start_date=None, end_date=None, publications=None, tags=None, pages=None):
+        self.start_date   = _as_date(start_date)
+        self.end_date     = _as_date(end_date)
+        self.publications = list(publications or [])
+        self.tags         = list(tags or [])
+        self.pages        = [str(page) for page in (pages or [])]
+
+    def __str__(self):
+        return f"SearchFilter({self.to_vertex_expression() or 'everything'})"
+
+    def __repr__(self):
+        return self.__str__()
+
+    def facets(self):
+        """(field, normalized values) for every set facet field, as stored in the local index"""
+        facets = []
+        if self.publications:
+            facets.append(("publication", [normalize_facet(value) for value in self.publications]))
+        if self.tags:
+            facets.append(("tags", [normalize_facet(value) for value in self.tags]))
+        if self.pages:
+            facets.append(("page", [normalize_facet(value) for value in self.pages]))
+        return facets
+
+    def matches(self, struct_data):
+        """Whether a single document's struct_data passes the filter"""
+        if self.start_date is not None or self.end_date is not None:
+            try:
+                ordinal = parse_date(struct_data["publication_date"]).ordinal
+            except (KeyError, ValueError):
+                return False
+            if self.start_date is not None and ordinal < self.start_date.ordinal:
+                return False
+            if self.end_date is not None and ordinal > self.end_date.ordinal:
+                return False
+
+        for field, values in self.facets():
+            if not set(facet_values(field, struct_data.get(field))) & set(values):
+                return False
+        return True
+
+    def to_vertex_expression(self):
+        """
+        The filter as a Discovery Engine filter expression, on the fields written by
+        utils/fix_json.py. Date bounds apply to publication_date_iso, the ISO form of
+        publication_date, which must be typed as a datetime in the data store schema. Facets are
+        matched on the normalized repeated fields, e.g. tags_facet: ANY("rivers state"), so that
+        matching is case insensitive and per tag, exactly as in matches().
+        """
+        clauses = []
+        if self.start_date is not None:
+            clauses.append(f'{date_field("publication_date")} >= "{_iso(self.start_date)}"')
+        if self.end_date is not None:
+            clauses.append(f'{date_field("publication_date")} <= "{_iso(self.end_date)}"')
+        for field, values in self.facets():
+            quoted = ", ".join('"' + value.replace('"', '\\"') + '"' for value in values)
+            clauses.append(f"{facet_field(field)}: ANY({quoted})")
+        return " AND ".join(clauses)
+
+
+def _as_date(value):
+    if value is None or isinstance(value, Date):
+        return value
+    return parse_date(value)
+
+
+def _iso(value):
+    return value.to_python_datetime().isoformat()
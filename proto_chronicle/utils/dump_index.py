@@ -0,0 +1,181 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+from array import array
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Random access into the raw archive dump (one json document per line), without rescanning it.
+#
+# The index is a binary sidecar next to the dump (dump.json -> dump.json.idx):
+#   header   magic, number of lines, hash table slots, and the dump's size and mtime, as uint64
+#   offsets  byte offset of every line, plus the end of the last line, as uint64
+#   table    open addressing hash table of (_id hash, line number + 1) pairs, as uint64, 0 if empty
+#
+# Lookups by position read one offset; lookups by _id probe the table (about one slot on
+# average, at most half full), then check the _id of the candidate line.
+
+MAGIC         = b"DUMPIDX1"
+HEADER_FORMAT = "<8sQQQQ"
+HEADER_SIZE   = struct.calcsize(HEADER_FORMAT)
+SUFFIX        = ".idx"
+
+
+def _loads(line):
+    return orjson.loads(line) if orjson is not None else json.loads(line)
+
+
+def id_hash(doc_id):
+    """Stable 64 bit hash of a document _id; 0 is reserved for empty slots"""
+    digest = hashlib.blake2b(str(doc_id).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") or 1
+
+
+def index_path_for(dump_path):
+    return dump_path + SUFFIX
+
+
+def build_index(dump_path, index_path=None):
+    """
+    Write the offset index of a dump file.
+
+    Args:
+        dump_path:  path to the dump, one json document per line
+        index_path: path of the sidecar, defaults to dump_path + ".idx"
+
+    Returns the number of indexed lines.
+    """
+    index_path = index_path or index_path_for(dump_path)
+    stat       = os.stat(dump_path)
+    offsets    = array("Q")
+    hashes     = array("Q")
+
+    with open(dump_path, "rb") as infile:
+        offset = 0
+        for line in infile:
+            if line.strip():
+                offsets.append(offset)
+                try:
+                    hashes.append(id_hash(_loads(line).get("_id", "")))
+                except ValueError:
+                    hashes.append(0)  # malformed line: reachable by position only
+            offset += len(line)
+        offsets.append(offset)
+
+    slots = 1
+    while slots < 2 * len(hashes):
+        slots *= 2
+    table = array("Q", bytes(16 * slots))
+    for position, h in enumerate(hashes):
+        if not h:
+            continue
+        slot = h & (slots - 1)
+        while table[2 * slot]:
+            slot = (slot + 1) & (slots - 1)
+        table[2 * slot]     = h
+        table[2 * slot + 1] = position + 1
+
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, len(hashes), slots, stat.st_size, stat.st_mtime_ns))
+        offsets.tofile(f)
+        table.tofile(f)
+    os.replace(tmp_path, index_path)
+    return len(hashes)
+
+
+def _map(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class DumpIndex():
+    """
+    Memory-mapped reader over a dump file and its offset index.
+
+    Args:
+        dump_path:  path to the dump
+        index_path: path of the sidecar, defaults to dump_path + ".idx"
+        rebuild:    build the index first if it is missing or older than the dump
+    """
+    def __init__(self, dump_path, index_path=None, rebuild=True):
+        index_path = index_path or index_path_for(dump_path)
+        if rebuild and not self._is_current(dump_path, index_path):
+            print(f"Indexing {dump_path}....")
+            build_index(dump_path, index_path)
+
+        self._index = _map(index_path)
+        magic, self._count, self._slots, _, _ = struct.unpack_from(HEADER_FORMAT, self._index, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{index_path} is not a dump index")
+        self._table_start = HEADER_SIZE + 8 * (self._count + 1)
+        self._dump        = _map(dump_path)
+
+    @staticmethod
+    def _is_current(dump_path, index_path):
+        if not os.path.exists(index_path):
+            return False
+        with open(index_path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            return False
+        magic, _, _, size, mtime = struct.unpack(HEADER_FORMAT, header)
+        stat = os.stat(dump_path)
+        return magic == MAGIC and size == stat.st_size and mtime == stat.st_mtime_ns
+
+    def __len__(self):
+        return self._count
+
+    def line(self, position):
+        """Raw bytes of the document at {position} (0 based, blank lines excluded), without its line break"""
+        if not 0 <= position < self._count:
+            raise IndexError(f"position {position} out of range for {self._count} documents")
+        start, end = struct.unpack_from("<QQ", self._index, HEADER_SIZE + 8 * position)
+        return self._dump[start:end].rstrip()
+
+    def get(self, position):
+        """The document at {position}"""
+        return _loads(self.line(position))
+
+    def position_of(self, doc_id):
+        """Position of the document with this _id, or None"""
+        h    = id_hash(doc_id)
+        slot = h & (self._slots - 1)
+        while True:
+            stored, position = struct.unpack_from("<QQ", self._index, self._table_start + 16 * slot)
+            if stored == 0:
+                return None
+            if stored == h and str(self.get(position - 1).get("_id", "")) == str(doc_id):
+                return position - 1
+            slot = (slot + 1) & (self._slots - 1)
+
+    def get_by_id(self, doc_id):
+        """The document with this _id, or None"""
+        position = self.position_of(doc_id)
+        return None if position is None else self.get(position)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the offset index of the archive dump")
+    parser.add_argument("dump_path", nargs="?", default="data/dump.json")
+    parser.add_argument("--position", type=int, help="print the document at this position")
+    parser.add_argument("--id", help="print the document with this _id")
+    args = parser.parse_args()
+
+    if args.position is None and args.id is None:
+        start    = time.perf_counter()
+        nb_lines = build_index(args.dump_path)
+        print(f"Indexed {nb_lines} documents of {args.dump_path} in {time.perf_counter() - start:.1f}s")
+    else:
+        index    = DumpIndex(args.dump_path)
+        document = index.get(args.position) if args.id is None else index.get_by_id(args.id)
+        print(json.dumps(document, indent=2, ensure_ascii=False))
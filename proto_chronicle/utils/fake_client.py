@@ -0,0 +1,123 @@
+import json
+import threading
+import time
+
+# Stand-in for anthropic.Anthropic() that answers locally after a simulated delay.
+#
+#   import enrich
+#   from utils.fake_client import FakeClient
+#   enrich.client = FakeClient(latency=0.5)
+
+class FakeContent:
+    def __init__(self, text):
+        self.type = "text"
+        self.text = text
+
+class FakeToolUse:
+    def __init__(self, name, input):
+        self.type  = "tool_use"
+        self.name  = name
+        self.input = input
+
+class FakeDelta:
+    def __init__(self, partial_json):
+        self.type         = "input_json_delta"
+        self.partial_json = partial_json
+
+class FakeEvent:
+    def __init__(self, type, delta=None, message=None, usage=None):
+        self.type    = type
+        self.delta   = delta
+        self.message = message
+        self.usage   = usage
+
+class FakeUsage:
+    def __init__(self, input_tokens, output_tokens):
+        self.input_tokens  = input_tokens
+        self.output_tokens = output_tokens
+
+class FakeMessage:
+    def __init__(self, content, input_tokens, output_tokens):
+        self.content = [content]
+        self.usage   = FakeUsage(input_tokens, output_tokens)
+
+class FakeMessages:
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, model, max_tokens, messages, tools=None, stream=False, **kwargs):
+        message = self.client.respond(model, messages, tools)
+        if stream:
+            return _stream(message)
+        return message
+
+class FakeClient:
+    """
+    Returns deterministic, well formed responses for the extraction and context prompts in enrich.py,
+    as text, as the input of the first of the call's tools, or streamed as input_json_delta events.
+
+    Args:
+        latency: seconds each call sleeps for, to simulate an llm round-trip
+    """
+    def __init__(self, latency=0.1):
+        self.latency  = latency
+        self.messages = FakeMessages(self)
+
+        # bookkeeping, so callers can check how many calls overlapped
+        self.calls         = 0
+        self.in_flight     = 0
+        self.max_in_flight = 0
+        self._lock         = threading.Lock()
+
+    def respond(self, model, messages, tools=None):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            prompt = messages[-1]["content"]
+            if not isinstance(prompt, str):
+                prompt = " ".join(part.get("text", "") for part in prompt)
+            fields = tools[0]["input_schema"]["properties"] if tools else ()
+            answer = self.answer(prompt, fields)
+            if tools:
+                properties = tools[0]["input_schema"]["properties"]
+                content    = FakeToolUse(tools[0]["name"], {k: answer.get(k, "") for k in properties})
+            else:
+                content    = FakeContent(json.dumps(answer))
+            return FakeMessage(
+                content       = content,
+                input_tokens  = len(prompt) // 4,
+                output_tokens = 50,
+            )
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def answer(self, prompt, fields=()):
+        if "relevant_extract" in fields or "relevant_extract" in prompt:
+            filename = _field(prompt, "Filename:")
+            return {"relevant_extract": f"Relevant portion of {filename}"}
+        return {
+            "title":   f"Coverage of {len(prompt)} characters",
+            "summary": prompt.strip().splitlines()[0][:200],
+        }
+
+
+def _stream(message):
+    content = message.content[0]
+    text    = json.dumps(content.input) if content.type == "tool_use" else content.text
+    yield FakeEvent("message_start", message=FakeMessage(content, message.usage.input_tokens, 1))
+    for start in range(0, len(text), 16):
+        yield FakeEvent("content_block_delta", FakeDelta(text[start:start + 16]))
+    yield FakeEvent("message_delta", usage=FakeUsage(None, message.usage.output_tokens))
+    yield FakeEvent("message_stop")
+
+
+def _field(prompt, name):
+    for line in prompt.splitlines():
+        line = line.strip()
+        if line.startswith(name):
+            return line[len(name):].strip()
+    return ""
@@ -1,25 +1,260 @@
+import argparse
+import gzip
 import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime           import date
 
-input_file = 'data/dump.json'
-output_file = 'data/formatted_dump.jsonl'
-
-with open(input_file, 'r', encoding='utf-8') as infile, \
-     open(output_file, 'w', encoding='utf-8') as outfile:
-    
-    for line in infile:
-        entry_data = json.loads(line)
-        
-        # 1. Clean the ID (Vertex doesn't like the leading underscore)
-        doc_id = str(entry_data.get('_id', '')).replace('_', '-')
-        
-        # 2. Extract the actual content
-        source_data = entry_data.get('_source', {})
-        
-        # 3. Build the Vertex AI compatible structure
-        vertex_doc = {
-            "id": doc_id,
-            "structData": source_data  # This maps summary, extract, etc.
-        }
-        
-        # Write as a single line
-        outfile.write(json.dumps(vertex_doc) + '\n')
\ No newline at end of file
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Converts the raw archive dump (one elasticsearch hit per line) into Vertex AI formatted jsonl:
+#   {"id": ..., "structData": {...the hit's _source..., "tags_facet": ["rivers state", ...], ...}}
+#
+# Vertex filters match string values exactly, so every facet field (see search_filter.py) is also
+# stored as a repeated field of normalized values, e.g. "Breaking News, Rivers State" as
+# tags_facet ["breaking news", "rivers state"]. Likewise the dump's "YYYY/MM/DD" publication_date
+# is also stored in ISO form as publication_date_iso, which the schema can type as a datetime.
+# SearchFilter filters on these, so that Vertex agrees with the local index and the fake backend;
+# they must be marked filterable in the schema.
+#
+# The dump is read in chunks of whole lines that are converted in parallel on a process pool,
+# and written in order to numbered shards sized for Discovery Engine imports, e.g.
+#   python utils/fix_json.py data/dump.json data/formatted_dump.jsonl --gzip
+# writes data/formatted_dump-00000.jsonl.gz, data/formatted_dump-00001.jsonl.gz, ...
+
+INPUT_FILE  = "data/dump.json"
+OUTPUT_FILE = "data/formatted_dump.jsonl"
+
+CHUNK_BYTES = 8 * 1024 * 1024  # input bytes converted per task
+# Discovery Engine imports files of up to 2GB each; shards are cut at chunk boundaries, so
+# they can overshoot this by up to one chunk
+SHARD_BYTES = 1024 * 1024 * 1024
+GZIP_LEVEL  = 6
+
+FACET_FIELDS = ("publication", "tags", "page")
+DATE_FIELDS  = ("publication_date",)
+
+
+def loads(line):
+    return orjson.loads(line) if orjson is not None else json.loads(line)
+
+
+def dumps(document):
+    if orjson is not None:
+        return orjson.dumps(document) + b"\n"
+    return (json.dumps(document) + "\n").encode("utf-8")
+
+
+def vertex_id(entry_data):
+    """Document id of a dump entry in Vertex AI; Vertex doesn't like the leading underscore"""
+    return str(entry_data.get("_id", "")).replace("_", "-")
+
+
+def normalize_facet(value):
+    return str(value).strip().lower()
+
+
+def facet_values(field, value):
+    """The normalized facet values of one field of a document; tags are comma separated"""
+    if value is None:
+        return []
+    if field == "tags":
+        items = value if isinstance(value, (list, tuple)) else str(value).split(",")
+        return [normalize_facet(item) for item in items if str(item).strip()]
+    return [normalize_facet(value)]
+
+
+def facet_field(field):
+    """Name of the repeated field holding the normalized values of a facet field in Vertex"""
+    return f"{field}_facet"
+
+
+def iso_date(value):
+    """A "YYYY/MM/DD" dump date as an ISO 8601 date, e.g. "2015-01-31", or None if it is not one"""
+    try:
+        year, month, day = str(value).split("/")
+        return date(int(year), int(month), int(day)).isoformat()
+    except ValueError:
+        return None
+
+
+def date_field(field):
+    """Name of the field holding the ISO form of a date field in Vertex"""
+    return f"{field}_iso"
+
+
+def load_entry(line):
+    """
+    The dump entry of one line, as a dict whose _source is a dict. Raises ValueError for a
+    malformed line, including valid json that is not such an entry.
+    """
+    entry_data = loads(line)
+    if not isinstance(entry_data, dict):
+        raise ValueError(f"expected a json object, got {type(entry_data).__name__}")
+    if not isinstance(entry_data.get("_source", {}), dict):
+        raise ValueError("_source is not a json object")
+    return entry_data
+
+
+def convert_line(line):
+    """One dump line as one Vertex formatted jsonl line, as bytes"""
+    entry_data = load_entry(line)
+
+    # 1. Clean the ID
+    doc_id = vertex_id(entry_data)
+
+    # 2. Extract the actual content, which maps summary, extract, etc.
+    source_data = entry_data.get("_source", {})
+
+    # 3. Index the facet fields as normalized repeated fields, and the dates in ISO form, for filtering
+    source_data = dict(source_data)
+    for field in FACET_FIELDS:
+        source_data[facet_field(field)] = facet_values(field, source_data.get(field))
+    for field in DATE_FIELDS:
+        iso = iso_date(source_data.get(field))
+        if iso is not None:
+            source_data[date_field(field)] = iso
+
+    # 4. Build the Vertex AI compatible structure
+    return dumps({"id": doc_id, "structData": source_data})
+
+
+def convert_chunk(chunk, compress=False):
+    """
+    Convert a chunk of whole dump lines. Runs in a worker process.
+
+    Returns (output bytes, number of documents, number of malformed lines skipped); with
+    {compress} the output is a gzip member, and gzip members can be concatenated into a file.
+    """
+    output  = []
+    skipped = 0
+    for line in chunk.splitlines():
+        if not line.strip():
+            continue
+        try:
+            output.append(convert_line(line))
+        except (ValueError, TypeError, KeyError, AttributeError):
+            skipped += 1
+    data = b"".join(output)
+    if compress:
+        data = gzip.compress(data, compresslevel=GZIP_LEVEL)
+    return data, len(output), skipped
+
+
+def read_chunks(input_file, chunk_bytes=CHUNK_BYTES):
+    """Yield chunks of about {chunk_bytes} bytes of the input file, ending on a line boundary"""
+    with open(input_file, "rb") as infile:
+        while True:
+            chunk = infile.read(chunk_bytes)
+            if not chunk:
+                return
+            yield chunk + infile.readline()
+
+
+def shard_path(output_file, shard, compress):
+    root, ext = os.path.splitext(output_file)
+    return f"{root}-{shard:05d}{ext or '.jsonl'}" + (".gz" if compress else "")
+
+
+class ShardWriter():
+    """Writes converted chunks in order, starting a new shard once {shard_bytes} is reached"""
+    def __init__(self, output_file, shard_bytes, compress):
+        self.output_file = output_file
+        self.shard_bytes = shard_bytes
+        self.compress    = compress
+        self.paths       = []
+        self._file       = None
+        self._size       = 0
+
+    def write(self, data):
+        if self._file is None or (self._size and self._size + len(data) > self.shard_bytes):
+            self._rotate()
+        self._file.write(data)
+        self._size += len(data)
+
+    def _rotate(self):
+        self.close()
+        path = shard_path(self.output_file, len(self.paths), self.compress)
+        self.paths.append(path)
+        self._file = open(path, "wb")
+        self._size = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            print(f"  wrote {self.paths[-1]} ({self._size / 1e6:.1f}MB)")
+            self._file = None
+
+
+def convert(input_file=INPUT_FILE, output_file=OUTPUT_FILE, workers=None, chunk_bytes=CHUNK_BYTES,
+            shard_bytes=SHARD_BYTES, compress=False):
+    """
+    Convert a dump file into sharded Vertex formatted jsonl.
+
+    Args:
+        input_file:  path to the raw dump, one json document per line
+        output_file: output path, shards are numbered from it (formatted_dump-00000.jsonl, ...)
+        workers:     number of worker processes, defaults to the number of cpus
+        chunk_bytes: input bytes converted per task
+        shard_bytes: size after which a new shard is started
+        compress:    gzip the shards
+
+    Returns the list of shard paths written.
+    """
+    workers     = workers or os.cpu_count() or 1
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    writer      = ShardWriter(output_file, shard_bytes, compress)
+    start       = time.perf_counter()
+    read_bytes  = 0
+    nb_docs     = 0
+    nb_skipped  = 0
+
+    print(f"Converting {input_file} with {workers} workers{' (orjson)' if orjson is not None else ''}....")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # keep a bounded number of chunks in flight, and write them back in input order
+        pending = []
+        for chunk in read_chunks(input_file, chunk_bytes):
+            read_bytes += len(chunk)
+            pending.append(pool.submit(convert_chunk, chunk, compress))
+            if len(pending) >= 2 * workers:
+                data, count, skipped = pending.pop(0).result()
+                writer.write(data)
+                nb_docs    += count
+                nb_skipped += skipped
+        for future in pending:
+            data, count, skipped = future.result()
+            writer.write(data)
+            nb_docs    += count
+            nb_skipped += skipped
+    writer.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Converted {nb_docs} documents ({read_bytes / 1e6:.1f}MB) into {len(writer.paths)} shards "
+          f"in {elapsed:.1f}s: {read_bytes / 1e6 / elapsed:.1f}MB/s, {nb_docs / elapsed:.0f} docs/s")
+    if nb_skipped:
+        print(f"Skipped {nb_skipped} malformed lines")
+    return writer.paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the archive dump into Vertex AI formatted jsonl shards")
+    parser.add_argument("input_file", nargs="?", default=INPUT_FILE)
+    parser.add_argument("output_file", nargs="?", default=OUTPUT_FILE)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: cpu count)")
+    parser.add_argument("--chunk-mb", type=float, default=CHUNK_BYTES / 1024 / 1024, help="input MB per task")
+    parser.add_argument("--shard-mb", type=float, default=SHARD_BYTES / 1024 / 1024, help="MB per output shard")
+    parser.add_argument("--gzip", action="store_true", help="gzip the output shards")
+    args = parser.parse_args()
+
+    convert(
+        args.input_file,
+        args.output_file,
+        workers=args.workers,
+        chunk_bytes=int(args.chunk_mb * 1024 * 1024),
+        shard_bytes=int(args.shard_mb * 1024 * 1024),
+        compress=args.gzip,
+    )
@@ -1,9 +1,4 @@
-from data.shape import Date
+from data.shape import parse_date
 
 def convertToDate(date_string):
-   date_split = date_string.split("/")
-   return Date(
-       day   = int(date_split[2]),
-       month = int(date_split[1]),
-       year  = int(date_split[0]),
-   )
\ No newline at end of file
+   return parse_date(date_string)
\ No newline at end of file
@@ -1,6 +1,7 @@
-import json
 import sys
 
+from dump_index import DumpIndex
+
 class Source():
     def __init__(self, summary, extract, filename, keywords, image_path, topics, publication, publication_date, page, tags):
         self.summary     = summary
@@ -22,51 +23,51 @@ class Entry():
         self.source = source
 
 
-def read_json(file_path):
+def read_json(file_path, target=12, doc_id=None):
     """
-    Read a JSON file and transform into a (dataframe, list of objects?)
+    Read one entry of the data dump, through its offset index (built on first use)
     
     Args:
         file_path: Path to the JSON file
+        target:    position of the entry in the file
+        doc_id:    _id of the entry, used instead of target if given
     """
-    idx = 0
-    target = 12
     try: 
-        with open(file=file_path, mode='r', encoding='utf-8') as file:
-            for line in file:
-                entry_data = json.loads(line)
-                source_data = entry_data.get('_source', {})
-                
-                # Create Source object
-                source = Source(
-                    summary=source_data.get('summary'),
-                    extract=source_data.get('extract'),
-                    filename=source_data.get('filename'),
-                    keywords=source_data.get('keywords'),
-                    image_path=source_data.get('image_path'),
-                    topics=source_data.get('topics'),
-                    publication=source_data.get('publication'),
-                    publication_date=source_data.get('publication_date'),
-                    page=source_data.get('page'),
-                    tags=source_data.get('tags')
-                )
-                
-                # Create Entry object
-                entry = Entry(
-                    index=entry_data.get('_index'),
-                    id=entry_data.get('_id'),
-                    score=entry_data.get('_score'),
-                    source=source
-                )
-                
-                if idx == target:
-                    return entry
-                idx += 1
+        index = DumpIndex(file_path)
+        entry_data = index.get(target) if doc_id is None else index.get_by_id(doc_id)
+        if entry_data is None:
+            print(f"No entry with _id {doc_id}")
+            return None
+        source_data = entry_data.get('_source', {})
+        
+        # Create Source object
+        source = Source(
+            summary=source_data.get('summary'),
+            extract=source_data.get('extract'),
+            filename=source_data.get('filename'),
+            keywords=source_data.get('keywords'),
+            image_path=source_data.get('image_path'),
+            topics=source_data.get('topics'),
+            publication=source_data.get('publication'),
+            publication_date=source_data.get('publication_date'),
+            page=source_data.get('page'),
+            tags=source_data.get('tags')
+        )
+        
+        # Create Entry object
+        return Entry(
+            index=entry_data.get('_index'),
+            id=entry_data.get('_id'),
+            score=entry_data.get('_score'),
+            source=source
+        )
     except Exception as e:
         print(f"Error reading data dump: {e}")
 
     
-entry = read_json('../data/dump.json')
+# usage: python inspect.py [position | _id]
+arg = sys.argv[1] if len(sys.argv) > 1 else "12"
+entry = read_json('../data/dump.json', target=int(arg)) if arg.isdigit() else read_json('../data/dump.json', doc_id=arg)
 
 print("Entry:")
 print("---- id:   ", entry.id)
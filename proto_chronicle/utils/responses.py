@@ -0,0 +1,313 @@
+import anthropic
+import itertools
+import json
+import re
+
+from utils.scheduler import INTERACTIVE, is_retryable, scheduler
+
+# Structured responses for every Claude call that expects json fields back (proto_chronicle/enrich.py,
+# interview_demo/api.py and interview_demo/enrich_buckets.py).
+#
+# Calls force a tool whose input schema lists the expected fields, so the answer arrives as a
+# parsed tool_use block. Plain text answers (older prompts, batch results, models ignoring the tool)
+# are parsed leniently: markdown fences and surrounding prose are dropped, and near-valid json
+# (trailing commas, raw newlines in strings) is repaired locally. Of an answer cut off by
+# max_tokens, only the complete fields are kept. Fields still missing are asked for on their own,
+# with the partial answer as context, instead of redoing the whole call.
+
+TOOL_NAME = "record_answer"
+MAX_REASKS = 1
+
+# a stream broken off by these keeps its complete fields; so does one cut by a retryable error,
+# which is streamed again instead when nothing was complete yet
+STREAM_ERRORS = (anthropic.APIConnectionError,)  # APITimeoutError included
+
+FENCE_PATTERN = re.compile(r"```(?:json)?")
+
+
+class ResponseError(ValueError):
+    """A response that could not be parsed, or that lacks required fields after re-asking"""
+
+
+def json_tool(fields, name=TOOL_NAME):
+    """
+    Tool definition whose input is an object of the required string {fields}.
+
+    Args:
+        fields: dict of field name -> description, in the order they should be generated
+        name:   tool name
+    """
+    return {
+        "name": name,
+        "description": "Record the answer. Every field is required.",
+        "input_schema": {
+            "type": "object",
+            "properties": {field: {"type": "string", "description": description} for field, description in fields.items()},
+            "required": list(fields),
+        },
+    }
+
+
+def tool_params(fields, name=TOOL_NAME):
+    """Extra create() parameters that force the answer through json_tool(fields)"""
+    return {"tools": [json_tool(fields, name)], "tool_choice": {"type": "tool", "name": name}}
+
+
+def repair_json(text):
+    """
+    Best effort valid json object from near-valid model output: the first object of text, without
+    fences, trailing commas or raw control characters in strings. Of an object that was cut off,
+    only the complete top-level members are kept: a value still being written, e.g. an open
+    string, is dropped rather than closed, so that it counts as missing.
+    """
+    text  = FENCE_PATTERN.sub("", text)
+    start = text.find("{")
+    if start < 0:
+        return text.strip()
+
+    out       = []
+    stack     = []
+    commas    = []  # (length of out, depth) at every comma outside strings, to cut back to
+    in_string = False
+    escape    = False
+    for ch in text[start:]:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            elif ch < " ":
+                ch = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}.get(ch, f"\\u{ord(ch):04x}")
+            out.append(ch)
+            continue
+
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if not stack:
+                continue
+            _strip_trailing_comma(out)
+            out.append(stack.pop())
+            if not stack:
+                break
+            continue
+        elif ch == ",":
+            commas.append((len(out), len(stack)))
+        out.append(ch)
+
+    if not stack:
+        return "".join(out)
+
+    # cut off right after a complete top-level value
+    if not in_string and len(stack) == 1:
+        closed = _close(out, stack)
+        if _is_json(closed):
+            return closed
+    # otherwise drop the incomplete last member, e.g. an open string or a key without its value
+    for length, depth in reversed(commas):
+        if depth == 1:
+            closed = _close(out[:length], stack[:1])
+            if _is_json(closed):
+                return closed
+    return "{}"
+
+
+def _is_json(text):
+    try:
+        json.loads(text)
+    except json.JSONDecodeError:
+        return False
+    return True
+
+
+def _strip_trailing_comma(out):
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ",":
+        out.pop()
+
+
+def _close(out, stack):
+    out = list(out)
+    _strip_trailing_comma(out)
+    if out and out[-1] == ":":
+        out.append("null")
+    return "".join(out) + "".join(reversed(stack))
+
+
+def parse_json(text):
+    """The json object in a model's text answer, repaired locally if needed"""
+    text = text.strip()
+    for candidate in (text, FENCE_PATTERN.sub("", text).strip(), repair_json(text)):
+        try:
+            result = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(result, dict):
+            return result
+    raise ResponseError(f"No json object in response: {text[:80]!r}")
+
+
+class JSONStream():
+    """
+    Incremental parser of a json object arriving in chunks, e.g. streamed tool input.
+
+    Top-level members are parsed as soon as they are complete, so fields can be used before the
+    object ends; of an object that never ends, value() only keeps the complete members.
+
+    Args:
+        on_field: optional function called with (name, value) of every completed top-level member
+    """
+    def __init__(self, on_field=None):
+        self.on_field = on_field
+        self.fields   = {}
+        self.buffer   = ""
+        self._pos          = 0
+        self._depth        = 0
+        self._in_string    = False
+        self._escape       = False
+        self._member_start = None
+        self._closed       = False
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        while self._pos < len(self.buffer):
+            ch = self.buffer[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"' and self._depth > 0:
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+                if self._depth == 1:
+                    self._member_start = self._pos + 1
+            elif ch in "}]" and self._depth > 0:
+                if self._depth == 1:
+                    self._end_member()
+                    self._closed = True
+                self._depth -= 1
+            elif ch == "," and self._depth == 1:
+                self._end_member()
+                self._member_start = self._pos + 1
+            self._pos += 1
+
+    def _end_member(self):
+        member = self.buffer[self._member_start:self._pos].strip()
+        if not member:
+            return
+        try:
+            parsed = json.loads("{" + member + "}")
+        except json.JSONDecodeError:
+            return
+        for name, value in parsed.items():
+            self.fields[name] = value
+            if self.on_field is not None:
+                self.on_field(name, value)
+
+    def value(self):
+        """The completed members, and once the object has ended, anything repair_json recovers"""
+        if self._closed:
+            try:
+                return {**parse_json(self.buffer), **self.fields}
+            except ResponseError:
+                pass
+        return dict(self.fields)
+
+
+def message_fields(message):
+    """
+    Answer of a message as a dict: the input of its first tool_use block, or else the json
+    object of its text. Cut off answers only keep their complete fields: a text answer through
+    repair_json, and the tool input of a message that stopped at max_tokens without the field
+    that was being written.
+    """
+    tool_uses = [block for block in message.content if getattr(block, "type", "text") == "tool_use"]
+    if not tool_uses:
+        return parse_json("".join(getattr(block, "text", "") for block in message.content))
+
+    result = dict(tool_uses[0].input)
+    if getattr(message, "stop_reason", None) == "max_tokens" and result:
+        del result[list(result)[-1]]
+    return result
+
+
+def missing_fields(result, fields):
+    """The required fields that are absent or blank in result"""
+    return [field for field in fields if not isinstance(result.get(field), str) or not result[field].strip()]
+
+
+def request_fields(client, fields, priority=INTERACTIVE, kind="llm", stream=False, on_field=None,
+                   max_reasks=MAX_REASKS, **params):
+    """
+    Make a call through the scheduler and return its answer as a dict with every required field.
+
+    Args:
+        client:     anthropic client
+        fields:     dict of required field name -> description
+        priority:   scheduler priority
+        kind:       name the call is traced under; re-asks are traced as "{kind}_reask"
+        stream:     stream the answer and parse it incrementally; when the stream breaks off, the
+                    fields completed so far are kept and only the others are asked again, and a
+                    stream cut by an overloaded or rate limit error before any field is retried
+        on_field:   with stream, function called with (name, value) as soon as a field is complete
+        max_reasks: number of follow-up calls for missing fields
+        **params:   parameters of client.messages.create, e.g. model, max_tokens, messages
+    """
+    result = _request(client, fields, priority, kind, stream, on_field, params)
+    for _ in range(max_reasks):
+        missing = missing_fields(result, fields)
+        if not missing:
+            break
+        print(f"Response is missing {', '.join(missing)}, asking for {'it' if len(missing) == 1 else 'them'} again")
+        followup = dict(params)
+        followup["messages"] = list(params["messages"]) + [
+            {"role": "assistant", "content": json.dumps({k: v for k, v in result.items() if k in fields})},
+            {"role": "user", "content": f"Your answer is missing {', '.join(missing)}. Provide only {'that field' if len(missing) == 1 else 'those fields'}."},
+        ]
+        answer = _request(client, {field: fields[field] for field in missing}, priority, f"{kind}_reask", False, None, followup)
+        result.update({field: answer[field] for field in missing if field in answer})
+
+    missing = missing_fields(result, fields)
+    if missing:
+        raise ResponseError(f"Missing required fields in response: {', '.join(missing)}")
+    return result
+
+
+def _request(client, fields, priority, kind, stream, on_field, params):
+    params = {**params, **tool_params(fields)}
+    if not stream:
+        try:
+            return message_fields(scheduler.create_message(client, priority=priority, kind=kind, **params))
+        except ResponseError:
+            return {}
+
+    for attempt in itertools.count():
+        parser = JSONStream(on_field)
+        try:
+            for event in scheduler.create_message(client, priority=priority, kind=kind, stream=True, **params):
+                if getattr(event, "type", None) != "content_block_delta":
+                    continue
+                delta = event.delta
+                if delta.type == "input_json_delta":
+                    parser.feed(delta.partial_json)
+                elif delta.type == "text_delta":
+                    parser.feed(delta.text)
+        except (anthropic.APIStatusError, *STREAM_ERRORS) as e:
+            retryable = is_retryable(e)
+            if not retryable and not isinstance(e, STREAM_ERRORS):
+                raise
+            if not parser.fields:
+                if retryable and attempt < scheduler.max_retries:
+                    continue  # the scheduler has backed off already
+                raise
+            print(f"Response stream broke off ({e}), keeping {', '.join(parser.fields)}")
+        return parser.value()
@@ -0,0 +1,254 @@
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+from utils.tokens  import estimate_tokens
+from utils.tracing import tracer
+
+# Shared scheduler for every Claude call (proto_chronicle/enrich.py, interview_demo/api.py and
+# interview_demo/enrich_buckets.py). Calls are admitted by token buckets for requests and tokens
+# per minute, interactive calls go ahead of batch ones, and rate limit / overload errors are
+# retried with jittered exponential backoff, honoring retry-after.
+#
+# The buckets and the priority queue live in one process. The api and enrich_buckets.py running
+# side by side each admit calls against their own quota, and interactive calls of one are not put
+# ahead of batch calls of the other. Give each process its share of the account's quota with
+# LLM_QUOTA_SHARE, e.g.
+#   LLM_QUOTA_SHARE=0.25 python enrich_buckets.py
+# next to an api started with LLM_QUOTA_SHARE=0.75. The account quota itself can be set with
+# LLM_REQUESTS_PER_MINUTE and LLM_TOKENS_PER_MINUTE.
+
+INTERACTIVE = 0
+BATCH       = 1
+
+REQUESTS_PER_MINUTE = int(os.environ.get("LLM_REQUESTS_PER_MINUTE", 50))
+TOKENS_PER_MINUTE   = int(os.environ.get("LLM_TOKENS_PER_MINUTE", 40000))
+QUOTA_SHARE         = float(os.environ.get("LLM_QUOTA_SHARE", 1.0))  # fraction of the quota for this process
+MAX_RETRIES         = 6
+BASE_DELAY          = 1.0   # seconds
+MAX_DELAY           = 60.0  # seconds
+
+# 429: rate limited, 529: overloaded; errors arriving mid-stream only carry their type
+RETRY_STATUSES = (429, 529)
+RETRY_TYPES    = ("rate_limit_error", "overloaded_error")
+
+# rough cost of one image block, in input tokens
+IMAGE_TOKENS = 1600
+
+
+def estimate_message_tokens(messages, max_tokens=0):
+    """Rough token count of a messages payload (see utils/tokens.py), plus its max_tokens"""
+    tokens = 0
+    images = 0
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            tokens += estimate_tokens(content)
+            continue
+        for block in content:
+            if block.get("type") == "image":
+                images += 1
+            else:
+                tokens += estimate_tokens(block.get("text", ""))
+    return tokens + images * IMAGE_TOKENS + max_tokens
+
+
+class TokenBucket():
+    """Allows {per_minute} units per minute, with bursts of up to a minute's worth"""
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate     = per_minute / 60.0
+        self.level    = float(per_minute)
+        self.updated  = time.monotonic()
+
+    def _refill(self, now):
+        self.level   = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until {amount} units are available (amounts above capacity wait for a full bucket)"""
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount, now):
+        self._refill(now)
+        self.level -= amount
+
+    def give_back(self, amount, now):
+        self._refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+
+class LLMScheduler():
+    """
+    Admits llm calls in priority order under requests-per-minute and tokens-per-minute limits.
+    Limits and priorities only hold within the process (see above).
+
+    Args:
+        requests_per_minute: request quota of the account
+        tokens_per_minute:   token quota of the account (input + output)
+        quota_share:         fraction of both quotas this process may use
+        max_retries:         retries of a call failing with a RETRY_STATUSES error
+    """
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE,
+                 quota_share=QUOTA_SHARE, max_retries=MAX_RETRIES, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+        if not 0 < quota_share <= 1:
+            raise ValueError(f"quota_share must be in (0, 1], got {quota_share}")
+        self.requests    = TokenBucket(requests_per_minute * quota_share)
+        self.tokens      = TokenBucket(tokens_per_minute * quota_share)
+        self.max_retries = max_retries
+        self.base_delay  = base_delay
+        self.max_delay   = max_delay
+
+        self._cond         = threading.Condition()
+        self._queue        = []  # heap of (priority, sequence number)
+        self._sequence     = itertools.count()
+        self._paused_until = 0.0
+
+        self.retries = 0
+
+    def create_message(self, client, priority=INTERACTIVE, kind="llm", **params):
+        """
+        client.messages.create(**params), once admitted by the scheduler.
+        The token estimate is corrected with the response's usage once the call returns, or for
+        stream=True, with the usage of the message_start and message_delta events once the stream
+        ends. Every attempt is traced under {kind}, e.g. "extract" or "context".
+        """
+        estimate = estimate_message_tokens(params.get("messages", []), params.get("max_tokens", 0))
+        ticket   = (priority, next(self._sequence))
+        model    = params.get("model")
+
+        for attempt in itertools.count():
+            queued = time.monotonic()
+            self._acquire(ticket, estimate)
+            started = time.monotonic()
+            try:
+                response = client.messages.create(**params)
+            except Exception as e:
+                tracer.llm_call(kind, model, time.monotonic() - started, waited=started - queued,
+                                status=_status(e), attempt=attempt)
+                with self._cond:
+                    self.tokens.give_back(estimate, time.monotonic())
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                self._back_off(e, attempt)
+                continue
+
+            if params.get("stream"):
+                return self._stream(response, kind, model, estimate, queued, started, attempt)
+
+            usage = getattr(response, "usage", None)
+            self._record(kind, model, estimate, queued, started, attempt,
+                         getattr(usage, "input_tokens", None), getattr(usage, "output_tokens", None))
+            return response
+
+    def _stream(self, events, kind, model, estimate, queued, started, attempt):
+        """
+        The events of a streamed call, recorded once the stream ends or breaks off. A retryable
+        error arriving mid-stream pauses every caller like any other before it is raised.
+        """
+        usage = {"input_tokens": None, "output_tokens": None}
+        try:
+            for event in events:
+                event_type = getattr(event, "type", None)
+                if event_type == "message_start":
+                    start_usage = getattr(getattr(event, "message", None), "usage", None)
+                    usage["input_tokens"]  = getattr(start_usage, "input_tokens", None)
+                    usage["output_tokens"] = getattr(start_usage, "output_tokens", None)
+                elif event_type == "message_delta":
+                    usage["output_tokens"] = getattr(getattr(event, "usage", None), "output_tokens", usage["output_tokens"])
+                yield event
+        except Exception as e:
+            self._record(kind, model, estimate, queued, started, attempt, status=_status(e), **usage)
+            if is_retryable(e):
+                self._back_off(e, attempt)
+            raise
+        except GeneratorExit:
+            # the caller stopped reading
+            self._record(kind, model, estimate, queued, started, attempt, **usage)
+            getattr(events, "close", lambda: None)()
+            raise
+        self._record(kind, model, estimate, queued, started, attempt, **usage)
+
+    def _record(self, kind, model, estimate, queued, started, attempt, input_tokens=None, output_tokens=None, status="ok"):
+        """Trace one attempt, and correct the token estimate with its usage where known"""
+        tracer.llm_call(kind, model, time.monotonic() - started, waited=started - queued, input_tokens=input_tokens,
+                        output_tokens=output_tokens, status=status, attempt=attempt)
+        if input_tokens is not None or output_tokens is not None:
+            used = (input_tokens or 0) + (output_tokens or 0)
+            with self._cond:
+                self.tokens.take(used - estimate, time.monotonic())
+
+    def _acquire(self, ticket, estimate):
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+            while True:
+                wait = None
+                if self._queue[0] == ticket:
+                    now  = time.monotonic()
+                    wait = max(
+                        self._paused_until - now,
+                        self.requests.wait_time(1, now),
+                        self.tokens.wait_time(estimate, now),
+                    )
+                    if wait <= 0:
+                        heapq.heappop(self._queue)
+                        self.requests.take(1, now)
+                        self.tokens.take(estimate, now)
+                        self._cond.notify_all()
+                        return
+                self._cond.wait(timeout=wait)
+
+    def _back_off(self, error, attempt):
+        """Pause every caller, for retry-after if the server sent one, else a jittered backoff"""
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        delay = random.uniform(delay / 2, delay)
+
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, self.base_delay)
+
+        print(f"LLM call failed with {_status(error)}, retrying in {delay:.1f}s")
+        with self._cond:
+            self.retries      += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self._cond.notify_all()
+        time.sleep(delay)
+
+
+def is_retryable(error):
+    """Whether a failed call should be retried: rate limited or overloaded, before or mid-stream"""
+    return getattr(error, "status_code", None) in RETRY_STATUSES or _error_type(error) in RETRY_TYPES
+
+
+def _error_type(error):
+    body  = getattr(error, "body", None)
+    error = body.get("error", body) if isinstance(body, dict) else None
+    return error.get("type") if isinstance(error, dict) else None
+
+
+def _status(error):
+    """Status of a failed call as traced: its http status, or for errors arriving mid-stream, their type"""
+    status = getattr(error, "status_code", None)
+    if status in (None, 200):
+        status = _error_type(error)
+    return str(status or type(error).__name__)
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    headers  = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+# one scheduler per process, shared by every call site of that process
+scheduler = LLMScheduler()
@@ -0,0 +1,66 @@
+import re
+
+# Fast local token estimates, to keep prompts within their input budgets without a tokenizer
+# or a count_tokens round trip. Claude's tokenizer averages about 4 characters per token on
+# English prose, and one token or more per word or punctuation mark on short-worded, numeric
+# or punctuated text (dates, names, figures), so an estimate takes the larger of the two counts.
+
+CHARS_PER_TOKEN = 4
+
+PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text):
+    """Estimated number of tokens of text; errs on the high side"""
+    if not text:
+        return 0
+    text = str(text)
+    return max(-(-len(text) // CHARS_PER_TOKEN), len(PIECE_PATTERN.findall(text)))
+
+
+def truncate_to_tokens(text, budget, marker=" [...]"):
+    """
+    Longest prefix of text, cut at a word boundary, whose estimate fits within {budget} tokens,
+    followed by {marker} when anything was cut. The result never exceeds the budget: a budget
+    too small for the marker gets a bare prefix. Deterministic for a given text and budget.
+    """
+    text = str(text or "")
+    budget = max(0, budget)
+    if estimate_tokens(text) <= budget:
+        return text
+
+    if estimate_tokens(marker) < budget:
+        budget -= estimate_tokens(marker)
+    else:
+        marker = ""
+    end = budget * CHARS_PER_TOKEN
+    while end > 0:
+        cut = text.rfind(" ", 0, end + 1)
+        end = cut if cut > 0 else end
+        if estimate_tokens(text[:end]) <= budget:
+            break
+        end = end * 9 // 10
+    return text[:end].rstrip() + marker
+
+
+def split_by_budget(items, cost, budget):
+    """
+    Split items into consecutive groups whose total cost fits within {budget}, in order.
+    An item costing more than the budget makes a group of its own.
+
+    Args:
+        items:  list of items
+        cost:   function of an item to its cost, e.g. in estimated tokens
+        budget: maximum total cost of a group
+    """
+    groups, group, total = [], [], 0
+    for item in items:
+        item_cost = cost(item)
+        if group and total + item_cost > budget:
+            groups.append(group)
+            group, total = [], 0
+        group.append(item)
+        total += item_cost
+    if group:
+        groups.append(group)
+    return groups
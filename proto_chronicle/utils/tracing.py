@@ -0,0 +1,137 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib  import contextmanager
+
+# Tracing of a pipeline run: wall time per stage, latency and token usage of every llm call,
+# cache hits and result counts. Every event is appended as a json line to the run's trace file,
+# e.g. {"run": "20250101-120000", "ts": 1735732800.0, "type": "llm_call", "kind": "extract", ...},
+# and summary() renders the whole run as tables.
+
+TRACE_DIR  = "data/traces"
+MAX_EVENTS = 10000  # events kept in memory for summary(); long-lived processes never start a run
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Tracer():
+    """
+    Collects the events of one run at a time; safe to call from worker threads.
+
+    Args:
+        path:       json lines file to append events to, or None to only keep them in memory
+        max_events: number of most recent events kept in memory
+    """
+    def __init__(self, path=None, max_events=MAX_EVENTS):
+        self.path   = path
+        self.run_id = None
+        self.events = deque(maxlen=max_events)
+        self._lock  = threading.Lock()
+        self._file  = None
+
+    def start_run(self, query, path=None, trace_dir=TRACE_DIR):
+        """Start a new run, traced to {path} or to a timestamped file of {trace_dir}"""
+        run_id = time.strftime("%Y%m%d-%H%M%S")
+        path   = path or os.path.join(trace_dir, f"{run_id}.jsonl")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._lock:
+            self._close_file()
+            self.run_id = run_id
+            self.path   = path
+            self.events.clear()
+        self.event("run", query=query)
+
+    def event(self, event_type, **fields):
+        record = {"run": self.run_id, "ts": time.time(), "type": event_type, **fields}
+        line   = json.dumps(record, default=str)
+        with self._lock:
+            self.events.append(record)
+            if self.path is not None:
+                if self._file is None:
+                    self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+                self._file.write(line + "\n")
+
+    def close(self):
+        """Close the trace file; it is reopened by the next event"""
+        with self._lock:
+            self._close_file()
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a pipeline stage. The yielded dict is recorded with the stage, for counts:
+
+            with tracer.stage("search") as span:
+                span["results"] = len(results)
+        """
+        span  = {}
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            self.event("stage", name=name, seconds=time.perf_counter() - start, **span)
+
+    def llm_call(self, kind, model, seconds, waited=0.0, input_tokens=None, output_tokens=None, status="ok", attempt=0):
+        """One llm call attempt: its latency, time spent waiting for admission, and usage"""
+        self.event("llm_call", kind=kind, model=model, seconds=seconds, waited=waited, input_tokens=input_tokens,
+                   output_tokens=output_tokens, status=status, attempt=attempt)
+
+    def cache(self, kind, hit):
+        self.event("cache", kind=kind, hit=hit)
+
+    def summary(self):
+        """The run's stages, llm calls and cache lookups, as text tables"""
+        with self._lock:
+            events = list(self.events)
+
+        lines  = [f"{'Stage':<12}{'Seconds':>10}  Counts"]
+        for event in events:
+            if event["type"] == "stage":
+                counts = ", ".join(f"{key}={value}" for key, value in event.items()
+                                   if key not in ("run", "ts", "type", "name", "seconds"))
+                lines.append(f"{event['name']:<12}{event['seconds']:>10.2f}  {counts}")
+
+        calls = {}
+        for event in events:
+            if event["type"] == "llm_call":
+                calls.setdefault(event["kind"], []).append(event)
+        if calls:
+            lines.append("")
+            lines.append(f"{'LLM calls':<12}{'Calls':>7}{'Errors':>8}{'p50 s':>8}{'p95 s':>8}{'Wait s':>8}"
+                         f"{'In tokens':>11}{'Out tokens':>12}")
+            for kind, kind_calls in calls.items():
+                latencies = [call["seconds"] for call in kind_calls]
+                lines.append(
+                    f"{kind:<12}{len(kind_calls):>7}"
+                    f"{sum(call['status'] != 'ok' for call in kind_calls):>8}"
+                    f"{_percentile(latencies, 0.5):>8.2f}{_percentile(latencies, 0.95):>8.2f}"
+                    f"{sum(call['waited'] for call in kind_calls):>8.2f}"
+                    f"{sum(call['input_tokens'] or 0 for call in kind_calls):>11}"
+                    f"{sum(call['output_tokens'] or 0 for call in kind_calls):>12}"
+                )
+
+        lookups = {}
+        for event in events:
+            if event["type"] == "cache":
+                hits, misses = lookups.get(event["kind"], (0, 0))
+                lookups[event["kind"]] = (hits + event["hit"], misses + (not event["hit"]))
+        if lookups:
+            lines.append("")
+            lines.append(f"{'Cache':<12}{'Hits':>7}{'Misses':>8}")
+            for kind, (hits, misses) in lookups.items():
+                lines.append(f"{kind:<12}{hits:>7}{misses:>8}")
+        return "\n".join(lines)
+
+
+# one tracer per process, shared by every instrumented module
+tracer = Tracer()